@@ -17,15 +17,30 @@ DATA_DIR.mkdir(exist_ok=True)
 # Ethereum RPC (supports Alchemy, Infura, or public nodes)
 ETH_RPC_URL = os.getenv("ETH_RPC_URL", "https://ethereum-rpc.publicnode.com")
 
+# Optional WebSocket endpoint (wss://…) for newHeads push; empty = HTTP polling
+ETH_WS_URL = os.getenv("ETH_WS_URL", "")
+
 # Database
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DATA_DIR / 'chainwatch.db'}")
 
+# Connection pool – sized for FastAPI's threadpool plus the background pipeline
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
 # Polling interval (seconds) – Ethereum avg block time is ~12s
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "12"))
 
 # ML settings
 ANOMALY_CONTAMINATION = float(os.getenv("ANOMALY_CONTAMINATION", "0.05"))
 N_CLUSTERS = int(os.getenv("N_CLUSTERS", "5"))
+# IsolationForest size: "auto" subsamples min(256, wallets) per tree
+IFOREST_N_ESTIMATORS = int(os.getenv("IFOREST_N_ESTIMATORS", "100"))
+IFOREST_MAX_SAMPLES = os.getenv("IFOREST_MAX_SAMPLES", "auto")
+if IFOREST_MAX_SAMPLES != "auto":
+    IFOREST_MAX_SAMPLES = int(IFOREST_MAX_SAMPLES)
+# Fitted scaler/IsolationForest/KMeans persisted across restarts; empty disables
+ML_MODEL_PATH = os.getenv("ML_MODEL_PATH", str(DATA_DIR / "ml_models.joblib"))
 
 # Risk weights
 RISK_WEIGHTS = {
@@ -36,10 +51,16 @@ RISK_WEIGHTS = {
 }
 
 # CORS
-CORS_ORIGINS = os.getenv(
-    "CORS_ORIGINS",
-    "http://localhost:5173,http://localhost:3000,http://localhost:8000"
-).split(",")
+CORS_ORIGINS = [
+    origin.strip() for origin in os.getenv(
+        "CORS_ORIGINS",
+        "http://localhost:5173,http://localhost:3000,http://localhost:8000"
+    ).split(",") if origin.strip()
+]
+# Local dev servers on any port; empty string disables the regex
+CORS_ORIGIN_REGEX = os.getenv(
+    "CORS_ORIGIN_REGEX", r"https?://(localhost|127\.0\.0\.1)(:\d+)?"
+) or None
 
 # Server port (for local deployment)
 PORT = int(os.getenv("PORT", "8000"))
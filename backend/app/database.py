@@ -4,42 +4,220 @@ SQLAlchemy engine, session management, and ORM models.
 Supports SQLite (dev) and PostgreSQL (prod) via DATABASE_URL.
 """
 
+import logging
 from datetime import datetime
+from typing import Dict, List, Optional
+
 from sqlalchemy import (
-    create_engine, Column, Integer, String, Float, DateTime,
-    Text, Boolean, Index
+    create_engine, event, inspect, text, String, Float, DateTime, Text, Index, LargeBinary,
+    TypeDecorator,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.pool import StaticPool
+from app.config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE
+
+logger = logging.getLogger("chainwatch.db")
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (
+    DATABASE_URL.rstrip("/") in ("sqlite:", "sqlite+pysqlite:") or ":memory:" in DATABASE_URL
+)
+
+# SQLite tuning applied to every new connection: WAL lets readers proceed
+# while the ingest/pipeline thread writes.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+# asyncio drivers used by the async engine that serves read endpoints
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _async_url(url: str) -> str:
+    """Swap the URL's DBAPI driver for its asyncio counterpart."""
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+', 1)[0], scheme)}://{rest}"
+
+
+# A plain in-memory DB is private to its connection; name it and use shared
+# cache so the sync and async engines see the same tables.
+ENGINE_URL = (
+    "sqlite:///file:chainwatch?mode=memory&cache=shared&uri=true"
+    if IS_SQLITE_MEMORY else DATABASE_URL
 )
-from sqlalchemy.orm import declarative_base, sessionmaker
-from app.config import DATABASE_URL
 
-# Handle SQLite-specific connect args
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+if IS_SQLITE_MEMORY:
+    # Keep one connection open for the life of the process so the DB persists
+    engine = create_engine(
+        ENGINE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+elif IS_SQLITE:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+else:
+    engine_kwargs = {}
+    if DATABASE_URL.split("://", 1)[0] in ("postgresql", "postgresql+psycopg2"):
+        # psycopg2 fast execution helpers: bulk inserts go out as paged
+        # multi-row VALUES, other executemany statements via execute_batch
+        engine_kwargs.update(
+            executemany_mode="values_plus_batch",
+            insertmanyvalues_page_size=1000,
+            executemany_batch_page_size=500,
+        )
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        **engine_kwargs,
+    )
+
+# Async engine for request handlers (aiosqlite / asyncpg). The pipeline and
+# services keep using the synchronous engine above.
+if IS_SQLITE_MEMORY:
+    async_engine = create_async_engine(_async_url(ENGINE_URL), poolclass=StaticPool)
+elif IS_SQLITE:
+    async_engine = create_async_engine(
+        _async_url(ENGINE_URL),
+        connect_args={"timeout": 30},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+else:
+    async_engine = create_async_engine(
+        _async_url(ENGINE_URL),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+        cursor = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+class Base(DeclarativeBase):
+    """Typed declarative base; server defaults come back in the INSERT (RETURNING)."""
+    __mapper_args__ = {"eager_defaults": True}
+    type_annotation_map = {float: Float}  # keep FLOAT columns, not DOUBLE
+
+
+# ── Server-side UTC timestamps ────────────────────────────────────────────────
+
+class utcnow(FunctionElement):
+    """
+    Current UTC time evaluated by the database (naive, like the rest of the app).
+    Used for server defaults and onupdate. Timestamp columns also keep a Python
+    default: create_all never adds DEFAULT clauses to tables that already exist.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"  # SQLite: already UTC
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+# ── Dialect-specific upsert ───────────────────────────────────────────────────
+
+def upsert(model, index_elements: List[str], update_columns: List[str]):
+    """
+    INSERT … ON CONFLICT (index_elements) DO UPDATE for SQLite and Postgres.
+    Execute with a list of row dicts to upsert a whole batch in one statement;
+    a model's updated_at is refreshed on conflict like the ORM onupdate would.
+    """
+    stmt = (sqlite_insert if IS_SQLITE else pg_insert)(model)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    if "updated_at" in model.__table__.c:
+        set_["updated_at"] = utcnow()
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+
+
+# ── Hex identifiers stored as raw bytes ──────────────────────────────────────
+
+def hex_to_bytes(value: str) -> bytes:
+    """'0xAbC1…' → b'\\xab\\xc1…' (prefix optional, case-insensitive)."""
+    return bytes.fromhex(value[2:] if value[:2] in ("0x", "0X") else value)
+
+
+def bytes_to_hex(value: bytes) -> str:
+    """b'\\xab\\xc1…' → '0xabc1…' (empty bytes → empty string)."""
+    return "0x" + value.hex() if value else ""
+
+
+class HexBinary(TypeDecorator):
+    """
+    0x-prefixed hex string in Python, fixed-width binary (BYTEA / BLOB) in the DB.
+    A 20-byte address takes a third of the space of its 42-char hex form,
+    so more keys fit per index page.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return hex_to_bytes(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return bytes_to_hex(value) if value is not None else None
 
 
 class Transaction(Base):
     """Stores raw Ethereum transactions."""
     __tablename__ = "transactions"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    tx_hash = Column(String(66), unique=True, nullable=False, index=True)
-    block_number = Column(Integer, nullable=False, index=True)
-    from_address = Column(String(42), nullable=False, index=True)
-    to_address = Column(String(42), nullable=True, index=True)
-    value_eth = Column(Float, default=0.0)
-    gas_price_gwei = Column(Float, default=0.0)
-    gas_used = Column(Integer, default=0)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    input_data_length = Column(Integer, default=0)
-    is_contract_call = Column(Boolean, default=False)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tx_hash: Mapped[str] = mapped_column(HexBinary(32), unique=True, index=True)
+    block_number: Mapped[int] = mapped_column(index=True)
+    from_address: Mapped[str] = mapped_column(HexBinary(20))
+    to_address: Mapped[Optional[str]] = mapped_column(HexBinary(20))
+    value_eth: Mapped[Optional[float]] = mapped_column(default=0.0)
+    gas_price_gwei: Mapped[Optional[float]] = mapped_column(default=0.0)
+    gas_used: Mapped[Optional[int]] = mapped_column(default=0)
+    timestamp: Mapped[Optional[datetime]] = mapped_column(
+        default=datetime.utcnow, server_default=utcnow()
+    )
+    input_data_length: Mapped[Optional[int]] = mapped_column(default=0)
+    is_contract_call: Mapped[Optional[bool]] = mapped_column(default=False)
 
     __table_args__ = (
         Index("ix_tx_block_from", "block_number", "from_address"),
+        Index("ix_tx_block_to", "block_number", "to_address"),
+        # Per-wallet lookups, ordered by block (also serve plain address filters)
+        Index("ix_tx_from_block", "from_address", "block_number"),
+        Index("ix_tx_to_block", "to_address", "block_number"),
+        Index("ix_tx_timestamp_value", "timestamp", "value_eth"),  # covers timeline aggregation
     )
 
 
@@ -47,56 +225,162 @@ class WalletProfile(Base):
     """Aggregated behavioural profile per wallet."""
     __tablename__ = "wallet_profiles"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    address = Column(String(42), unique=True, nullable=False, index=True)
-    tx_count = Column(Integer, default=0)
-    total_value_sent = Column(Float, default=0.0)
-    total_value_received = Column(Float, default=0.0)
-    avg_value = Column(Float, default=0.0)
-    unique_counterparties = Column(Integer, default=0)
-    inflow_outflow_ratio = Column(Float, default=0.0)
-    tx_frequency = Column(Float, default=0.0)
-    burst_score = Column(Float, default=0.0)
-    cluster_label = Column(Integer, default=-1)
-    risk_score = Column(Float, default=0.0)
-    last_active = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    address: Mapped[str] = mapped_column(HexBinary(20), unique=True, index=True)
+    tx_count: Mapped[Optional[int]] = mapped_column(default=0)
+    total_value_sent: Mapped[Optional[float]] = mapped_column(default=0.0)
+    total_value_received: Mapped[Optional[float]] = mapped_column(default=0.0)
+    avg_value: Mapped[Optional[float]] = mapped_column(default=0.0)
+    unique_counterparties: Mapped[Optional[int]] = mapped_column(default=0)
+    inflow_outflow_ratio: Mapped[Optional[float]] = mapped_column(default=0.0)
+    tx_frequency: Mapped[Optional[float]] = mapped_column(default=0.0)
+    burst_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    cluster_label: Mapped[Optional[int]] = mapped_column(default=-1)
+    risk_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    last_active: Mapped[Optional[datetime]] = mapped_column(
+        default=datetime.utcnow, server_default=utcnow()
+    )
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        default=datetime.utcnow, server_default=utcnow(), onupdate=utcnow()
+    )
 
 
 class Alert(Base):
     """Generated alerts for suspicious behaviour."""
     __tablename__ = "alerts"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    wallet_address = Column(String(42), nullable=False, index=True)
-    alert_type = Column(String(50), nullable=False)  # anomaly, flash_loan, wash_trade, high_centrality
-    severity = Column(String(20), default="medium")   # low, medium, high, critical
-    risk_score = Column(Float, default=0.0)
-    explanation = Column(Text, default="")
-    tx_hash = Column(String(66), nullable=True)
-    block_number = Column(Integer, nullable=True)
-    is_resolved = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    wallet_address: Mapped[str] = mapped_column(HexBinary(20), index=True)
+    alert_type: Mapped[str] = mapped_column(String(50))  # anomaly, flash_loan, wash_trade, high_centrality
+    severity: Mapped[Optional[str]] = mapped_column(String(20), default="medium")  # low, medium, high, critical
+    risk_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    explanation: Mapped[Optional[str]] = mapped_column(Text, default="")
+    tx_hash: Mapped[Optional[str]] = mapped_column(HexBinary(32))
+    block_number: Mapped[Optional[int]]
+    is_resolved: Mapped[Optional[bool]] = mapped_column(default=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(
+        default=datetime.utcnow, server_default=utcnow()
+    )
+
+    __table_args__ = (
+        Index("ix_alert_created_at", "created_at"),
+    )
 
 
 class RiskScore(Base):
     """Composite risk scores with component breakdown."""
     __tablename__ = "risk_scores"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    wallet_address = Column(String(42), nullable=False, index=True)
-    composite_score = Column(Float, default=0.0)
-    ml_anomaly_score = Column(Float, default=0.0)
-    graph_score = Column(Float, default=0.0)
-    flash_loan_score = Column(Float, default=0.0)
-    wash_trade_score = Column(Float, default=0.0)
-    explanation = Column(Text, default="")
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    wallet_address: Mapped[str] = mapped_column(HexBinary(20), index=True)
+    composite_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    ml_anomaly_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    graph_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    flash_loan_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    wash_trade_score: Mapped[Optional[float]] = mapped_column(default=0.0)
+    explanation: Mapped[Optional[str]] = mapped_column(Text, default="")
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        default=datetime.utcnow, server_default=utcnow(), onupdate=utcnow()
+    )
+
+
+# ── Upgrading databases created before HexBinary ─────────────────────────────
+
+def _text_hex_columns() -> Dict[str, List[str]]:
+    """HexBinary columns that an existing DB still declares as 0x-hex text, by table."""
+    inspector = inspect(engine)
+    stale: Dict[str, List[str]] = {}
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        names = [
+            column.name for column in table.columns
+            if isinstance(column.type, HexBinary) and isinstance(existing.get(column.name), String)
+        ]
+        if names:
+            stale[table.name] = names
+    return stale
+
+
+def _convert_hex_columns_postgresql(stale: Dict[str, List[str]]):
+    """ALTER the text columns to BYTEA in place, decoding each value."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, columns in stale.items():
+            # The old lower() CHECKs are not defined for bytea
+            for check in inspector.get_check_constraints(table_name):
+                conn.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{check["name"]}"'))
+            for column in columns:
+                conn.execute(text(
+                    f'ALTER TABLE "{table_name}" ALTER COLUMN "{column}" TYPE BYTEA '
+                    f"USING decode(regexp_replace(\"{column}\", '^0[xX]', ''), 'hex')"
+                ))
+
+
+def _convert_hex_columns_sqlite(stale: Dict[str, List[str]]):
+    """
+    SQLite can't change a column's type: rebuild each table from the current
+    model and copy the rows across, decoding the hex columns on the way.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        conn.connection.dbapi_connection.create_function(
+            "hex_to_blob", 1,
+            lambda value: hex_to_bytes(value) if isinstance(value, str) else value,
+            deterministic=True,
+        )
+        for table_name, columns in stale.items():
+            table = Base.metadata.tables[table_name]
+            old_name = f"{table_name}_hex_text"
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            # Index names are global in SQLite; free them for the new table
+            for index in inspector.get_indexes(table_name):
+                conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+            conn.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{old_name}"'))
+            table.create(conn)
+
+            copied = [column.name for column in table.columns if column.name in existing]
+            column_list = ", ".join(f'"{name}"' for name in copied)
+            select_list = ", ".join(
+                f'hex_to_blob("{name}")' if name in columns else f'"{name}"' for name in copied
+            )
+            conn.execute(text(
+                f'INSERT INTO "{table_name}" ({column_list}) SELECT {select_list} FROM "{old_name}"'
+            ))
+            conn.execute(text(f'DROP TABLE "{old_name}"'))
+
+
+def _upgrade_hex_columns():
+    """
+    Databases created before tx hashes / addresses were stored as bytes still
+    hold them as 0x-hex text, which HexBinary can neither read nor match.
+    Convert those columns (and their rows) to binary before anything else runs.
+    """
+    stale = _text_hex_columns()
+    if not stale:
+        return
+    logger.warning(f"Converting hex text columns to binary: {stale}")
+    try:
+        if IS_SQLITE:
+            _convert_hex_columns_sqlite(stale)
+        else:
+            _convert_hex_columns_postgresql(stale)
+    except Exception as e:
+        raise RuntimeError(
+            f"Could not convert the hex text columns of the existing database ({stale}) "
+            f"to binary: {e}. Remove or migrate the database at DATABASE_URL and restart."
+        ) from e
+    logger.info("Hex text columns converted")
 
 
 def init_db():
-    """Create all tables."""
+    """Create all tables, plus any indexes added since an existing DB was created."""
+    _upgrade_hex_columns()
     Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 def get_db():
@@ -106,3 +390,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Async session dependency for read endpoints."""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -6,19 +6,30 @@ and automatic analysis pipeline triggers.
 
 import asyncio
 import logging
+import multiprocessing as mp
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 
-from fastapi import FastAPI, Depends, HTTPException, Query
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Float, Integer, cast, func, literal_column, select, union_all
 
-from app.config import CORS_ORIGINS
-from app.database import init_db, get_db, Transaction, WalletProfile, Alert, RiskScore
+from app.config import CORS_ORIGINS, CORS_ORIGIN_REGEX
+from app.database import (
+    IS_SQLITE, IS_SQLITE_MEMORY, SessionLocal, async_engine, init_db, get_db,
+    get_async_db, hex_to_bytes, Transaction, WalletProfile, Alert, RiskScore,
+)
+from app.services import pipeline
 from app.services.blockchain import blockchain_service
-from app.services.ml_engine import ml_engine
 from app.services.graph_analysis import graph_analyzer
 from app.services.flash_loan import flash_loan_detector
 from app.services.risk_engine import risk_engine
@@ -31,6 +42,60 @@ logging.basicConfig(
 logger = logging.getLogger("chainwatch")
 
 
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (native datetime/float encoding)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+# ─── Detection pipeline worker ────────────────────────────────────────────────
+# A single dedicated worker process runs the detection pipeline so runs never
+# overlap on the database and the sklearn / networkx work stays off the API's
+# GIL. Blocks that arrive while a run is in flight are coalesced into one
+# follow-up run. A private in-memory SQLite DB can't be shared with another
+# process, so that setup falls back to a worker thread.
+def _new_pipeline_executor() -> Executor:
+    if IS_SQLITE_MEMORY:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+    return ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=mp.get_context("forkserver"),
+        initializer=pipeline.init_worker,
+    )
+
+
+_pipeline_executor = _new_pipeline_executor()
+_pipeline_running = asyncio.Event()
+_pipeline_pending = False
+_pipeline_task: Optional[asyncio.Task] = None
+_pipeline_epoch = 0  # bumped after every detection run; invalidates cached risk scores
+
+
+async def _run_in_pipeline_worker(fn):
+    """Run fn on the pipeline worker, replacing the process pool if it died."""
+    global _pipeline_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_pipeline_executor, fn)
+    except BrokenProcessPool:
+        logger.error("Pipeline worker process died. Starting a new one.")
+        _pipeline_executor = _new_pipeline_executor()
+        raise
+
+
+async def _run_detection_pipeline() -> Dict[str, Any]:
+    """Run the detection pipeline in the worker and apply its graph to this process."""
+    global _pipeline_epoch
+    result = await _run_in_pipeline_worker(pipeline.run_detection)
+    graph_analyzer.load_state(result.pop("graph_state"))
+    blockchain_service.last_analysis_at = datetime.utcnow()
+    _pipeline_epoch += 1
+    return result
+
+
 # ─── Lifespan ─────────────────────────────────────────────────────────────────
 
 @asynccontextmanager
@@ -53,37 +118,22 @@ async def lifespan(app: FastAPI):
             )
 
             # Run full detection pipeline on initial data
-            def run_initial_pipeline():
-                from app.database import SessionLocal
-                db = SessionLocal()
-                try:
-                    train_result = ml_engine.train(db)
-                    logger.info(f"ML training: {train_result.get('status', 'unknown')}")
-
-                    predictions = ml_engine.predict(db)
-                    if predictions:
-                        ml_engine.update_wallet_profiles(db, predictions)
-                        logger.info(f"Profiled {len(predictions)} wallets")
-
-                    graph_result = graph_analyzer.build_graph(db)
-                    logger.info(
-                        f"Graph: {graph_result.get('nodes', 0)} nodes, "
-                        f"{graph_result.get('edges', 0)} edges, "
-                        f"{graph_result.get('communities', 0)} communities"
-                    )
-
-                    result = risk_engine.run_full_detection(db)
-                    logger.info(
-                        f"Initial detection: {result.get('alerts_generated', 0)} alerts, "
-                        f"{result.get('wallets_profiled', 0)} wallets profiled"
-                    )
-                    blockchain_service.last_analysis_at = datetime.utcnow()
-                except Exception as e:
-                    logger.error(f"Initial pipeline error: {e}", exc_info=True)
-                finally:
-                    db.close()
-
-            await asyncio.to_thread(run_initial_pipeline)
+            try:
+                result = await _run_detection_pipeline()
+                logger.info(
+                    f"ML training: {result['ml_training'].get('status', 'unknown')}, "
+                    f"profiled {result.get('wallets_profiled', 0)} wallets"
+                )
+                logger.info(
+                    f"Graph: {result.get('graph_nodes', 0)} nodes, "
+                    f"{result.get('graph_edges', 0)} edges"
+                )
+                logger.info(
+                    f"Initial detection: {result.get('alerts_generated', 0)} alerts, "
+                    f"{result.get('wallets_profiled', 0)} wallets profiled"
+                )
+            except Exception as e:
+                logger.error(f"Initial pipeline error: {e}", exc_info=True)
             logger.info("✅ Initial analysis pipeline complete. Dashboard ready.")
 
         except Exception as e:
@@ -91,47 +141,59 @@ async def lifespan(app: FastAPI):
 
     await initial_ingest()
 
-    # ── Background polling for new blocks ──
-    async def on_new_block(block_number: int):
-        """Callback after each polled block batch – run full detection pipeline."""
-        logger.info(f"Block {block_number} ingested. Running detection pipeline...")
-
-        def run_full_pipeline():
-            from app.database import SessionLocal
-            db = SessionLocal()
-            try:
-                train_result = ml_engine.train(db)
-                predictions = ml_engine.predict(db)
-                if predictions:
-                    ml_engine.update_wallet_profiles(db, predictions)
-
-                graph_analyzer.build_graph(db)
-
-                result = risk_engine.run_full_detection(db)
-                logger.info(
-                    f"Detection: {result.get('alerts_generated', 0)} alerts, "
-                    f"{result.get('wallets_profiled', 0)} wallets"
-                )
-
-                blockchain_service.last_analysis_at = datetime.utcnow()
-            except Exception as e:
-                logger.error(f"Pipeline error: {e}", exc_info=True)
-            finally:
-                db.close()
-
+    # ── Warm the graph before serving if the initial pipeline didn't build it ──
+    if graph_analyzer.graph.number_of_nodes() == 0:
         try:
-            await asyncio.to_thread(run_full_pipeline)
+            graph_analyzer.load_state(await _run_in_pipeline_worker(pipeline.build_graph_state))
         except Exception as e:
-            logger.error(f"Post-block detection thread error: {e}")
+            logger.error(f"Graph warm-up error: {e}", exc_info=True)
+
+    # ── Post-block detection pipeline ──
+    async def drain_pipeline():
+        """Run the pipeline until no blocks arrived during the previous run."""
+        global _pipeline_pending
+        try:
+            while True:
+                _pipeline_pending = False
+                try:
+                    result = await _run_detection_pipeline()
+                    logger.info(
+                        f"Detection: {result.get('alerts_generated', 0)} alerts, "
+                        f"{result.get('wallets_profiled', 0)} wallets"
+                    )
+                except Exception as e:
+                    logger.error(f"Pipeline error: {e}", exc_info=True)
+                if not _pipeline_pending:
+                    break
+                logger.info("New blocks arrived during detection. Re-running pipeline...")
+        finally:
+            _pipeline_running.clear()
+
+    # ── Background head subscription / polling for new blocks ──
+    async def on_new_block(block_number: int):
+        """Callback after each polled block batch – schedule the detection pipeline."""
+        global _pipeline_pending, _pipeline_task
+        if _pipeline_running.is_set():
+            _pipeline_pending = True
+            logger.info(f"Block {block_number} ingested. Pipeline busy, coalescing.")
+            return
+
+        logger.info(f"Block {block_number} ingested. Running detection pipeline...")
+        _pipeline_running.set()
+        _pipeline_task = asyncio.create_task(drain_pipeline())
 
     polling_task = asyncio.create_task(
-        blockchain_service.start_polling(callback=on_new_block)
+        blockchain_service.subscribe_heads(callback=on_new_block)
     )
 
     yield
 
     blockchain_service.stop_polling()
     polling_task.cancel()
+    if _pipeline_task:
+        _pipeline_task.cancel()
+    _pipeline_executor.shutdown(wait=False, cancel_futures=True)
+    await async_engine.dispose()
     logger.info("ChainWatch shut down.")
 
 
@@ -140,18 +202,38 @@ app = FastAPI(
     description="AI-powered Ethereum blockchain monitoring and anomaly detection platform",
     version="2.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
-# CORS – allow all common origins
+# CORS – explicit origins plus one regex (compiled once by the middleware);
+# no blanket "*" so matching stays a set lookup
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=CORS_ORIGINS + ["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_origin_regex=CORS_ORIGIN_REGEX,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+# ─── Conditional GET ──────────────────────────────────────────────────────────
+
+def dashboard_cache_headers(request: Request) -> Dict[str, str]:
+    """
+    Weak ETag for dashboard data: it only changes when blocks are ingested or
+    a detection run finishes, so polling clients get a bodiless 304 until then.
+    """
+    etag = (
+        f'W/"{blockchain_service.last_processed_block}-'
+        f'{blockchain_service.total_blocks_processed}-{_pipeline_epoch}"'
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=5"}
+    if request.headers.get("if-none-match") == etag:
+        raise HTTPException(status_code=304, headers=headers)
+    return headers
+
+
 # ─── Health ────────────────────────────────────────────────────────────────────
 
 @app.get("/api/health")
@@ -159,7 +241,7 @@ def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
         "web3_connected": blockchain_service.is_connected,
         "mode": blockchain_service.mode,
         "last_processed_block": blockchain_service.last_processed_block,
@@ -168,15 +250,33 @@ def health_check():
 
 # ─── Status (detailed monitoring) ─────────────────────────────────────────────
 
+STATUS_COUNTS_TTL = 5.0  # seconds – COUNT(*) is a full scan, dashboards poll often
+_status_counts: Optional[Tuple[float, Dict[str, int]]] = None
+
+
+async def _get_status_counts(db: AsyncSession) -> Dict[str, int]:
+    """Row counts for the status endpoint, refreshed at most every STATUS_COUNTS_TTL."""
+    global _status_counts
+    now = time.monotonic()
+    if _status_counts and now - _status_counts[0] < STATUS_COUNTS_TTL:
+        return _status_counts[1]
+
+    counts = {
+        "transactions": await db.scalar(select(func.count(Transaction.id))) or 0,
+        "wallets": await db.scalar(select(func.count(WalletProfile.id))) or 0,
+        "alerts": await db.scalar(select(func.count(Alert.id))) or 0,
+    }
+    _status_counts = (now, counts)
+    return counts
+
+
 @app.get("/api/status")
-def get_status(db: Session = Depends(get_db)):
+async def get_status(db: AsyncSession = Depends(get_async_db)):
     """
     Detailed system status: RPC connection, last block, total transactions,
     last analysis timestamp, and mode (live / simulation).
     """
-    total_tx = db.query(func.count(Transaction.id)).scalar() or 0
-    total_wallets = db.query(func.count(WalletProfile.id)).scalar() or 0
-    total_alerts = db.query(func.count(Alert.id)).scalar() or 0
+    counts = await _get_status_counts(db)
 
     return {
         "rpc_connected": blockchain_service.is_connected,
@@ -184,59 +284,58 @@ def get_status(db: Session = Depends(get_db)):
         "rpc_url": blockchain_service._rpc_url[:50] + "..." if len(blockchain_service._rpc_url) > 50 else blockchain_service._rpc_url,
         "last_processed_block": blockchain_service.last_processed_block,
         "total_blocks_processed": blockchain_service.total_blocks_processed,
-        "total_transactions": total_tx,
-        "total_wallets_profiled": total_wallets,
-        "total_alerts": total_alerts,
-        "last_analysis_at": blockchain_service.last_analysis_at.isoformat() if blockchain_service.last_analysis_at else None,
+        "total_transactions": counts["transactions"],
+        "total_wallets_profiled": counts["wallets"],
+        "total_alerts": counts["alerts"],
+        "last_analysis_at": blockchain_service.last_analysis_at,
         "polling_active": blockchain_service._polling,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
     }
 
 
 # ─── Live Transactions ────────────────────────────────────────────────────────
 
 @app.get("/api/live-transactions")
-def get_live_transactions(
+async def get_live_transactions(
     limit: int = Query(50, ge=1, le=500),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    cache_headers: Dict[str, str] = Depends(dashboard_cache_headers),
 ):
     """Get the most recent transactions from the database."""
-    txns = (
-        db.query(Transaction)
+    rows = (await db.execute(
+        select(
+            Transaction.tx_hash,
+            Transaction.block_number,
+            Transaction.from_address,
+            Transaction.to_address,
+            Transaction.value_eth,
+            Transaction.gas_price_gwei,
+            Transaction.timestamp,
+            Transaction.is_contract_call,
+        )
         .order_by(Transaction.block_number.desc(), Transaction.id.desc())
         .limit(limit)
-        .all()
-    )
-    return {
-        "count": len(txns),
-        "transactions": [
-            {
-                "tx_hash": tx.tx_hash,
-                "block_number": tx.block_number,
-                "from_address": tx.from_address,
-                "to_address": tx.to_address,
-                "value_eth": tx.value_eth,
-                "gas_price_gwei": tx.gas_price_gwei,
-                "timestamp": tx.timestamp.isoformat() if tx.timestamp else None,
-                "is_contract_call": tx.is_contract_call,
-            }
-            for tx in txns
-        ],
-    }
+    )).mappings().all()
+    # Returned directly so FastAPI skips jsonable_encoder; orjson handles datetimes
+    return ORJSONResponse({
+        "count": len(rows),
+        "transactions": [dict(row) for row in rows],
+    }, headers=cache_headers)
 
 
 # ─── Run Detection Pipeline ───────────────────────────────────────────────────
 
 @app.post("/api/run-detection")
-def run_detection(db: Session = Depends(get_db)):
+async def run_detection():
     """
     Manually trigger the full detection pipeline:
     ML training, graph analysis, flash-loan detection, wash-trade detection,
     risk scoring, and alert generation.
+    Runs on the same single pipeline worker as the automatic runs, so it
+    queues behind one already in flight instead of overlapping it.
     """
     try:
-        result = risk_engine.run_full_detection(db)
-        blockchain_service.last_analysis_at = datetime.utcnow()
+        result = await _run_detection_pipeline()
         return {"status": "success", **result}
     except Exception as e:
         logger.error(f"Detection pipeline error: {e}")
@@ -246,100 +345,107 @@ def run_detection(db: Session = Depends(get_db)):
 # ─── Wallet Profiles ──────────────────────────────────────────────────────────
 
 @app.get("/api/wallet-profiles")
-def get_wallet_profiles(
+async def get_wallet_profiles(
     limit: int = Query(100, ge=1, le=1000),
     sort_by: str = Query("risk_score", pattern="^(risk_score|tx_count|total_value_sent)$"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    cache_headers: Dict[str, str] = Depends(dashboard_cache_headers),
 ):
     """Get wallet profiles sorted by risk score or other metrics."""
     order_col = getattr(WalletProfile, sort_by, WalletProfile.risk_score)
-    profiles = (
-        db.query(WalletProfile)
+    rows = (await db.execute(
+        select(
+            WalletProfile.address,
+            WalletProfile.tx_count,
+            WalletProfile.total_value_sent,
+            WalletProfile.total_value_received,
+            WalletProfile.avg_value,
+            WalletProfile.unique_counterparties,
+            WalletProfile.inflow_outflow_ratio,
+            WalletProfile.tx_frequency,
+            WalletProfile.burst_score,
+            WalletProfile.cluster_label,
+            WalletProfile.risk_score,
+            WalletProfile.last_active,
+        )
         .order_by(order_col.desc())
         .limit(limit)
-        .all()
-    )
-    return {
-        "count": len(profiles),
-        "profiles": [
-            {
-                "address": p.address,
-                "tx_count": p.tx_count,
-                "total_value_sent": round(p.total_value_sent, 6),
-                "total_value_received": round(p.total_value_received, 6),
-                "avg_value": round(p.avg_value, 6),
-                "unique_counterparties": p.unique_counterparties,
-                "inflow_outflow_ratio": round(p.inflow_outflow_ratio, 4),
-                "tx_frequency": round(p.tx_frequency, 4),
-                "burst_score": p.burst_score,
-                "cluster_label": p.cluster_label,
-                "risk_score": round(p.risk_score, 2),
-                "last_active": p.last_active.isoformat() if p.last_active else None,
-            }
-            for p in profiles
-        ],
-    }
+    )).mappings().all()
+    return ORJSONResponse({
+        "count": len(rows),
+        "profiles": [dict(row) for row in rows],
+    }, headers=cache_headers)
 
 
 # ─── Alerts ───────────────────────────────────────────────────────────────────
 
 @app.get("/api/alerts")
-def get_alerts(
+async def get_alerts(
     limit: int = Query(50, ge=1, le=500),
     alert_type: Optional[str] = Query(None),
     severity: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    cache_headers: Dict[str, str] = Depends(dashboard_cache_headers),
 ):
     """Get generated alerts, optionally filtered by type or severity."""
-    query = db.query(Alert).order_by(Alert.created_at.desc())
+    query = select(
+        Alert.id,
+        Alert.wallet_address,
+        Alert.alert_type,
+        Alert.severity,
+        Alert.risk_score,
+        Alert.explanation,
+        Alert.tx_hash,
+        Alert.block_number,
+        Alert.is_resolved,
+        Alert.created_at,
+    ).order_by(Alert.created_at.desc(), Alert.id.desc())
 
     if alert_type:
-        query = query.filter(Alert.alert_type == alert_type)
+        query = query.where(Alert.alert_type == alert_type)
     if severity:
-        query = query.filter(Alert.severity == severity)
+        query = query.where(Alert.severity == severity)
 
-    alerts = query.limit(limit).all()
-    return {
-        "count": len(alerts),
-        "alerts": [
-            {
-                "id": a.id,
-                "wallet_address": a.wallet_address,
-                "alert_type": a.alert_type,
-                "severity": a.severity,
-                "risk_score": round(a.risk_score, 2),
-                "explanation": a.explanation,
-                "tx_hash": a.tx_hash,
-                "block_number": a.block_number,
-                "is_resolved": a.is_resolved,
-                "created_at": a.created_at.isoformat() if a.created_at else None,
-            }
-            for a in alerts
-        ],
-    }
+    rows = (await db.execute(query.limit(limit))).mappings().all()
+    return ORJSONResponse({
+        "count": len(rows),
+        "alerts": [dict(row) for row in rows],
+    }, headers=cache_headers)
 
 
 # ─── Graph Data ───────────────────────────────────────────────────────────────
 
+def _require_graph():
+    """The graph is built at startup and by the pipeline, never on the request path."""
+    if graph_analyzer.graph.number_of_nodes() == 0:
+        raise HTTPException(status_code=503, detail="graph warming up")
+
+
 @app.get("/api/graph-data")
-def get_graph_data(db: Session = Depends(get_db)):
+def get_graph_data(cache_headers: Dict[str, str] = Depends(dashboard_cache_headers)):
     """
     Get wallet interaction graph data for visualization.
     Returns nodes (wallets) and links (transactions) for force-graph rendering.
     """
-    if graph_analyzer.graph.number_of_nodes() == 0:
-        graph_analyzer.build_graph(db)
-
+    _require_graph()
     data = graph_analyzer.get_graph_data()
-    return data
+    return ORJSONResponse(data, headers=cache_headers)
 
 
 # ─── Timeline Data ────────────────────────────────────────────────────────────
 
+def _hour_bucket(column):
+    """Hourly bucket label ("YYYY-MM-DD HH:00") for the active SQL dialect."""
+    if IS_SQLITE:
+        return func.strftime("%Y-%m-%d %H:00", column)
+    return func.to_char(func.date_trunc("hour", column), "YYYY-MM-DD HH24:00")
+
+
 @app.get("/api/timeline-data")
-def get_timeline_data(
+async def get_timeline_data(
     hours: int = Query(24, ge=1, le=168),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    cache_headers: Dict[str, str] = Depends(dashboard_cache_headers),
 ):
     """
     Get time-series data for transaction volume and alert count.
@@ -347,49 +453,70 @@ def get_timeline_data(
     """
     cutoff = datetime.utcnow() - timedelta(hours=hours)
 
-    # Transaction volume per hour
-    tx_timeline = (
-        db.query(
-            func.strftime("%Y-%m-%d %H:00", Transaction.timestamp).label("hour"),
+    # Transaction volume and alert count per hour, merged in a single
+    # UNION ALL aggregation instead of two queries joined in Python
+    tx_hours = (
+        select(
+            _hour_bucket(Transaction.timestamp).label("hour"),
             func.count(Transaction.id).label("tx_count"),
             func.sum(Transaction.value_eth).label("total_value"),
+            literal_column("0").label("alert_count"),
         )
-        .filter(Transaction.timestamp >= cutoff)
+        .where(Transaction.timestamp >= cutoff)
         .group_by("hour")
-        .order_by("hour")
-        .all()
     )
-
-    # Alert count per hour
-    alert_timeline = (
-        db.query(
-            func.strftime("%Y-%m-%d %H:00", Alert.created_at).label("hour"),
+    alert_hours = (
+        select(
+            _hour_bucket(Alert.created_at).label("hour"),
+            literal_column("0").label("tx_count"),
+            literal_column("0.0").label("total_value"),
             func.count(Alert.id).label("alert_count"),
         )
-        .filter(Alert.created_at >= cutoff)
+        .where(Alert.created_at >= cutoff)
         .group_by("hour")
-        .order_by("hour")
-        .all()
     )
+    buckets = union_all(tx_hours, alert_hours).subquery()
+
+    # SUM over integers is NUMERIC on Postgres (Decimal, which orjson rejects);
+    # cast back so the driver hands over plain ints/floats
+    tx_count = func.sum(buckets.c.tx_count)
+    timeline = (await db.execute(
+        select(
+            buckets.c.hour,
+            cast(tx_count, Integer).label("tx_count"),
+            cast(func.coalesce(func.sum(buckets.c.total_value), 0.0), Float).label("total_value"),
+            cast(func.sum(buckets.c.alert_count), Integer).label("alert_count"),
+        )
+        .group_by(buckets.c.hour)
+        .having(tx_count > 0)
+        .order_by(buckets.c.hour)
+    )).mappings().all()
 
-    alert_map = {a.hour: a.alert_count for a in alert_timeline}
-
-    return {
+    return ORJSONResponse({
         "hours": hours,
-        "timeline": [
-            {
-                "hour": row.hour,
-                "tx_count": row.tx_count,
-                "total_value": round(row.total_value or 0, 4),
-                "alert_count": alert_map.get(row.hour, 0),
-            }
-            for row in tx_timeline
-        ],
-    }
+        "timeline": [dict(row) for row in timeline],
+    }, headers=cache_headers)
 
 
 # ─── Risk Score ───────────────────────────────────────────────────────────────
 
+RISK_CACHE_BLOCKS = 50  # a cached score is reused within one 50-block window
+
+
+@lru_cache(maxsize=4096)
+def _cached_risk(wallet_address: str, block_window: int, epoch: int) -> Dict[str, Any]:
+    """
+    compute_risk memoized per (wallet, block window, pipeline epoch): repeat
+    lookups of hot wallets skip the graph / flash-loan / wash-trade scoring.
+    Callers must copy the result before modifying it.
+    """
+    db = SessionLocal()
+    try:
+        return risk_engine.compute_risk(db, wallet_address)
+    finally:
+        db.close()
+
+
 @app.get("/api/risk-score/{wallet_address}")
 def get_risk_score(wallet_address: str, db: Session = Depends(get_db)):
     """
@@ -397,14 +524,18 @@ def get_risk_score(wallet_address: str, db: Session = Depends(get_db)):
     Computes score if missing, otherwise returns cached version.
     """
     wallet_address = wallet_address.lower()
+    try:
+        hex_to_bytes(wallet_address)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid wallet address")
 
-    # Check if wallet has transactions
-    tx_count = db.query(Transaction).filter(
+    # Cheap presence probe first – an index lookup that stops at the first row
+    has_tx = db.query(Transaction.id).filter(
         (Transaction.from_address == wallet_address) |
         (Transaction.to_address == wallet_address)
-    ).count()
+    ).limit(1).scalar() is not None
 
-    if tx_count == 0:
+    if not has_tx:
         return {
             "wallet_address": wallet_address,
             "composite_score": 0,
@@ -413,10 +544,21 @@ def get_risk_score(wallet_address: str, db: Session = Depends(get_db)):
             "tx_count": 0,
         }
 
+    # Two single-index counts instead of one OR scan (self-transfers counted once)
+    tx_count = (
+        db.query(func.count(Transaction.id))
+        .filter(Transaction.from_address == wallet_address)
+        .scalar()
+        + db.query(func.count(Transaction.id))
+        .filter(Transaction.to_address == wallet_address, Transaction.from_address != wallet_address)
+        .scalar()
+    )
+
     try:
-        risk = risk_engine.compute_risk(db, wallet_address)
-        risk["tx_count"] = tx_count
-        return risk
+        # None until the first ingest succeeds (e.g. RPC down at boot, DB kept)
+        block_window = (blockchain_service.last_processed_block or 0) // RISK_CACHE_BLOCKS
+        risk = _cached_risk(wallet_address, block_window, _pipeline_epoch)
+        return {**risk, "tx_count": tx_count}
     except Exception as e:
         logger.error(f"Risk computation error for {wallet_address}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -449,7 +591,6 @@ def get_flash_loans(db: Session = Depends(get_db)):
 @app.get("/api/wash-trades")
 def get_wash_trades(db: Session = Depends(get_db)):
     """Get detected wash-trading pairs."""
-    if graph_analyzer.graph.number_of_nodes() == 0:
-        graph_analyzer.build_graph(db)
+    _require_graph()
     pairs = graph_analyzer.detect_wash_trading(db)
     return {"count": len(pairs), "pairs": pairs}
@@ -7,16 +7,25 @@ Includes retry logic, connection validation, and simulation fallback.
 import asyncio
 import logging
 import random
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple
 
-from web3 import Web3
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from web3 import AsyncWeb3, Web3, WebSocketProvider
 from web3.exceptions import Web3RPCError
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
-from app.config import ETH_RPC_URL, POLL_INTERVAL
-from app.database import SessionLocal, Transaction, init_db
+from app.config import ETH_RPC_URL, ETH_WS_URL, POLL_INTERVAL
+from app.database import IS_SQLITE, SessionLocal, Transaction, init_db
 
 logger = logging.getLogger("chainwatch.blockchain")
 
@@ -29,6 +38,44 @@ FALLBACK_RPCS = [
 ]
 
 MAX_CONSECUTIVE_ERRORS = 10  # Number of consecutive poll errors before simulation fallback
+RPC_BATCH_SIZE = 20      # Blocks per JSON-RPC batch (public nodes cap batch size)
+RPC_BATCH_PAUSE = 0.15   # Seconds between consecutive batches
+RPC_MAX_CONCURRENCY = 16  # Batches in flight when fetching concurrently
+STORE_LOOKUP_CHUNK = 5000  # tx hashes per IN lookup (SQLite bound-parameter limit)
+SEEN_HASHES_CAPACITY = 200_000  # Recently stored tx hashes kept in memory
+RPC_PROBE_TIMEOUT = 5  # Seconds per endpoint when racing RPCs on connect
+WEI_PER_ETH = 10**18
+WEI_PER_GWEI = 10**9
+BLOCK_NUMBER_TTL = 2.0  # Seconds to reuse eth_blockNumber (well under the 12s block time)
+
+# Shared session for the Web3 provider and raw JSON-RPC batch posts – keeps
+# TCP/TLS connections alive across calls and reconnects
+_rpc_session = requests.Session()
+_rpc_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.3),
+)
+_rpc_session.mount("https://", _rpc_adapter)
+_rpc_session.mount("http://", _rpc_adapter)
+
+# Connect-time probes get their own session without retries, so a dead
+# endpoint fails within RPC_PROBE_TIMEOUT instead of after retry backoff
+_probe_session = requests.Session()
+
+
+def _as_int(value: Any) -> int:
+    """Raw JSON-RPC returns hex quantities; web3 returns ints."""
+    if isinstance(value, str):
+        return int(value, 16)
+    return int(value or 0)
+
+
+def _as_hex(value: Any) -> str:
+    """Raw JSON-RPC returns hex strings; web3 returns HexBytes."""
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    return str(value) if value else "0x"
 
 
 class BlockchainService:
@@ -42,6 +89,11 @@ class BlockchainService:
         self.total_blocks_processed: int = 0
         self._polling = False
         self._simulation_mode = False
+        # Recently stored or re-seen tx hashes, least recently used first (LRU)
+        self._seen_hashes: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_lock = threading.Lock()
+        # (block_number, monotonic fetch time) of the last eth_blockNumber call
+        self._latest_block_cache: Optional[Tuple[int, float]] = None
         self._connect()
         # Log connection status on startup
         if self.is_connected:
@@ -51,33 +103,66 @@ class BlockchainService:
 
     # ── Connection management ─────────────────────────────────────────────────
 
+    @staticmethod
+    def _probe(url: str) -> bool:
+        """One eth_chainId call with a short timeout; True if the endpoint answers."""
+        try:
+            provider = Web3.HTTPProvider(
+                url, request_kwargs={"timeout": RPC_PROBE_TIMEOUT}, session=_probe_session
+            )
+            Web3(provider).eth.chain_id
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to connect to {url}: {e}")
+            return False
+
     def _connect(self):
-        """Try to connect to primary RPC, then fallbacks."""
-        urls_to_try = [self._rpc_url] + FALLBACK_RPCS
+        """
+        Probe the primary RPC and fallbacks concurrently. The primary is used
+        whenever it answers within RPC_PROBE_TIMEOUT; otherwise the first
+        fallback to answer wins.
+        """
+        urls_to_try = list(dict.fromkeys([self._rpc_url] + FALLBACK_RPCS))
 
-        for url in urls_to_try:
+        executor = ThreadPoolExecutor(max_workers=len(urls_to_try))
+        futures = {executor.submit(self._probe, url): url for url in urls_to_try}
+        primary = next(iter(futures))
+        try:
             try:
-                provider = Web3.HTTPProvider(url, request_kwargs={"timeout": 15})
-                w3 = Web3(provider)
-                if w3.is_connected():
-                    self.w3 = w3
-                    self._rpc_url = url
-                    self._simulation_mode = False
-                    logger.info(f"Web3 connected via {url}")
+                if primary.result(timeout=RPC_PROBE_TIMEOUT):
+                    self._use_rpc(futures[primary])
                     return
-                else:
-                    logger.warning(f"Web3 not connected via {url}")
-            except Exception as e:
-                logger.warning(f"Failed to connect to {url}: {e}")
+            except FuturesTimeout:
+                logger.warning(f"{futures[primary]} did not answer within {RPC_PROBE_TIMEOUT}s")
+
+            fallbacks = [future for future in futures if future is not primary]
+            for future in as_completed(fallbacks, timeout=RPC_PROBE_TIMEOUT * 4):
+                if future.result():
+                    self._use_rpc(futures[future])
+                    return
+        except FuturesTimeout:
+            logger.warning("Timed out waiting for RPC endpoints to answer")
+        finally:
+            # Don't wait on slower endpoints once a winner is chosen
+            executor.shutdown(wait=False, cancel_futures=True)
 
         # All RPCs failed → simulation mode
         logger.error("All RPC endpoints failed. Entering simulation mode.")
         self._simulation_mode = True
         self.w3 = Web3()  # disconnected instance
 
+    def _use_rpc(self, url: str):
+        self.w3 = Web3(Web3.HTTPProvider(
+            url, request_kwargs={"timeout": 15}, session=_rpc_session
+        ))
+        self._rpc_url = url
+        self._simulation_mode = False
+        logger.info(f"Web3 connected via {url}")
+
     def reconnect(self):
         """Attempt to reconnect after failures."""
         logger.info("Attempting reconnection...")
+        self._latest_block_cache = None
         self._connect()
 
     @property
@@ -102,7 +187,13 @@ class BlockchainService:
             base = 22_100_000
             offset = int((datetime.utcnow() - datetime(2026, 1, 1)).total_seconds() / 12)
             return base + offset
-        return self.w3.eth.block_number
+        cached = self._latest_block_cache
+        now = time.monotonic()
+        if cached and now - cached[1] < BLOCK_NUMBER_TTL:
+            return cached[0]
+        latest = self.w3.eth.block_number
+        self._latest_block_cache = (latest, now)
+        return latest
 
     def fetch_block_transactions(self, block_number: int) -> List[Dict[str, Any]]:
         """
@@ -124,26 +215,138 @@ class BlockchainService:
                     logger.error(f"All retries failed for block {block_number}, generating simulation data")
                     return self._generate_simulated_transactions(block_number)
 
-        timestamp = datetime.utcfromtimestamp(block["timestamp"])
+        return self._parse_block(block)
+
+    def fetch_blocks_batch(self, block_numbers: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Fetch several blocks with a single JSON-RPC batch request.
+        Blocks missing from the batch response fall back to per-block fetching.
+        Returns {block_number: parsed transactions}.
+        """
+        if self._simulation_mode:
+            return {b: self._generate_simulated_transactions(b) for b in block_numbers}
+
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        for offset in range(0, len(block_numbers), RPC_BATCH_SIZE):
+            if offset:
+                time.sleep(RPC_BATCH_PAUSE)  # Rate limit protection, once per batch
+            chunk = block_numbers[offset:offset + RPC_BATCH_SIZE]
+            try:
+                blocks = self._rpc_batch(
+                    [("eth_getBlockByNumber", [hex(b), True]) for b in chunk]
+                )
+            except Exception as e:
+                logger.warning(f"Batch fetch of {len(chunk)} blocks failed: {e}")
+                blocks = [None] * len(chunk)
+
+            for block_num, block in zip(chunk, blocks):
+                if block:
+                    results[block_num] = self._parse_block(block)
+                else:
+                    results[block_num] = self.fetch_block_transactions(block_num)
+        return results
+
+    async def fetch_blocks_async(self, block_numbers: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Async counterpart of fetch_blocks_batch: the RPC_BATCH_SIZE batches are
+        posted concurrently over aiohttp (at most RPC_MAX_CONCURRENCY in flight)
+        instead of one after another. Blocks missing from a response fall back
+        to per-block fetching on a worker thread.
+        """
+        if self._simulation_mode:
+            return self.fetch_blocks_batch(block_numbers)
+
+        chunks = [
+            block_numbers[i:i + RPC_BATCH_SIZE]
+            for i in range(0, len(block_numbers), RPC_BATCH_SIZE)
+        ]
+        semaphore = asyncio.Semaphore(RPC_MAX_CONCURRENCY)
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            async def fetch_chunk(chunk: List[int]) -> List[Any]:
+                async with semaphore:
+                    return await self._rpc_batch_async(
+                        session, [("eth_getBlockByNumber", [hex(b), True]) for b in chunk]
+                    )
+
+            responses = await asyncio.gather(
+                *(fetch_chunk(chunk) for chunk in chunks), return_exceptions=True
+            )
+
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        for chunk, blocks in zip(chunks, responses):
+            if isinstance(blocks, Exception):
+                logger.warning(f"Batch fetch of {len(chunk)} blocks failed: {blocks}")
+                blocks = [None] * len(chunk)
+            for block_num, block in zip(chunk, blocks):
+                if block:
+                    results[block_num] = self._parse_block(block)
+                else:
+                    results[block_num] = await asyncio.to_thread(self.fetch_block_transactions, block_num)
+        return results
+
+    @staticmethod
+    def _batch_payload(calls: List[Tuple[str, list]]) -> List[Dict[str, Any]]:
+        return [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+
+    @staticmethod
+    def _batch_results(body: Any, n_calls: int) -> List[Any]:
+        """Order a batch response by request id; entries that errored are None."""
+        if not isinstance(body, list):
+            # Node rejected the batch as a whole (e.g. batch size limit)
+            raise ValueError(body.get("error", body) if isinstance(body, dict) else body)
+
+        results: List[Any] = [None] * n_calls
+        for item in body:
+            if "result" in item and isinstance(item.get("id"), int) and item["id"] < n_calls:
+                results[item["id"]] = item["result"]
+        return results
+
+    def _rpc_batch(self, calls: List[Tuple[str, list]]) -> List[Any]:
+        """
+        POST a list of (method, params) calls as one JSON-RPC batch.
+        Returns results in call order; entries that errored are None.
+        """
+        resp = _rpc_session.post(self._rpc_url, json=self._batch_payload(calls), timeout=30)
+        resp.raise_for_status()
+        return self._batch_results(resp.json(), len(calls))
+
+    async def _rpc_batch_async(
+        self, session: aiohttp.ClientSession, calls: List[Tuple[str, list]]
+    ) -> List[Any]:
+        """_rpc_batch over a shared aiohttp session."""
+        async with session.post(self._rpc_url, json=self._batch_payload(calls)) as resp:
+            resp.raise_for_status()
+            body = await resp.json(content_type=None)
+        return self._batch_results(body, len(calls))
+
+    def _parse_block(self, block: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Parse a full block (web3 or raw JSON-RPC form) into transaction dicts."""
+        block_number = _as_int(block["number"])
+        timestamp = datetime.utcfromtimestamp(_as_int(block["timestamp"]))
         parsed: List[Dict[str, Any]] = []
 
-        for tx in block.transactions:
+        for tx in block["transactions"]:
             try:
-                value_eth = float(self.w3.from_wei(tx["value"], "ether"))
-                gas_price_gwei = float(self.w3.from_wei(tx.get("gasPrice", 0), "gwei"))
-                input_data = tx.get("input", "0x")
-                is_contract = len(input_data) > 2 if input_data else False
+                # int / int true division is correctly rounded – no Decimal round trip
+                value_eth = _as_int(tx["value"]) / WEI_PER_ETH
+                gas_price_gwei = _as_int(tx.get("gasPrice", 0)) / WEI_PER_GWEI
+                input_data = _as_hex(tx.get("input"))
+                is_contract = len(input_data) > 2
 
                 parsed.append({
-                    "tx_hash": tx["hash"].hex() if isinstance(tx["hash"], bytes) else str(tx["hash"]),
+                    "tx_hash": _as_hex(tx["hash"]).lower(),
                     "block_number": block_number,
-                    "from_address": tx["from"].lower() if tx["from"] else "",
-                    "to_address": tx["to"].lower() if tx["to"] else None,
+                    "from_address": tx["from"].lower() if tx.get("from") else "",
+                    "to_address": tx["to"].lower() if tx.get("to") else None,
                     "value_eth": value_eth,
                     "gas_price_gwei": gas_price_gwei,
-                    "gas_used": tx.get("gas", 0),
+                    "gas_used": _as_int(tx.get("gas", 0)),
                     "timestamp": timestamp,
-                    "input_data_length": len(input_data) if input_data else 0,
+                    "input_data_length": len(input_data),
                     "is_contract_call": is_contract,
                 })
             except Exception as e:
@@ -184,25 +387,51 @@ class BlockchainService:
 
     def store_transactions(self, db: Session, tx_list: List[Dict[str, Any]]) -> int:
         """Store parsed transactions in the database. Returns count of new rows."""
-        stored = 0
-        for tx_data in tx_list:
-            try:
-                existing = db.query(Transaction).filter_by(tx_hash=tx_data["tx_hash"]).first()
-                if existing:
-                    continue
-                db.add(Transaction(**tx_data))
-                stored += 1
-            except Exception as e:
-                logger.warning(f"DB insert error for tx {tx_data.get('tx_hash', '?')}: {e}")
-                db.rollback()
+        # Drop duplicates within the batch and hashes stored recently (re-polls)
+        with self._seen_lock:
+            rows = []
+            for tx_hash, tx_data in {tx_data["tx_hash"]: tx_data for tx_data in tx_list}.items():
+                if tx_hash in self._seen_hashes:
+                    self._seen_hashes.move_to_end(tx_hash)  # hit: now most recently used
+                else:
+                    rows.append(tx_data)
+        if not rows:
+            return 0
+        batch_hashes = [row["tx_hash"] for row in rows]
 
-        if stored > 0:
-            try:
-                db.commit()
-            except Exception as e:
-                logger.error(f"DB commit error: {e}")
-                db.rollback()
-                stored = 0
+        try:
+            if IS_SQLITE:
+                # Chunked IN lookups for the whole batch, then one executemany
+                existing = set()
+                for i in range(0, len(batch_hashes), STORE_LOOKUP_CHUNK):
+                    existing.update(db.scalars(
+                        select(Transaction.tx_hash)
+                        .where(Transaction.tx_hash.in_(batch_hashes[i:i + STORE_LOOKUP_CHUNK]))
+                    ))
+                rows = [row for row in rows if row["tx_hash"] not in existing]
+                if rows:
+                    db.execute(insert(Transaction), rows)
+                stored = len(rows)
+            else:
+                # Idempotent on the unique tx_hash – no pre-SELECT needed
+                stmt = (
+                    pg_insert(Transaction)
+                    .on_conflict_do_nothing(index_elements=["tx_hash"])
+                    .returning(Transaction.id)
+                )
+                stored = len(db.execute(stmt, rows).all())
+            db.commit()
+        except Exception as e:
+            logger.error(f"DB insert error for {len(rows)} txs: {e}")
+            db.rollback()
+            return 0
+
+        # Every hash in the batch is now in the table, inserted or pre-existing
+        with self._seen_lock:
+            for tx_hash in batch_hashes:
+                self._seen_hashes[tx_hash] = None
+            while len(self._seen_hashes) > SEEN_HASHES_CAPACITY:
+                self._seen_hashes.popitem(last=False)
         return stored
 
     # ── Manual bulk ingest ────────────────────────────────────────────────────
@@ -213,17 +442,16 @@ class BlockchainService:
         latest = self.get_latest_block_number()
         start_block = latest - n_blocks + 1
 
-        total_txs = 0
-        total_stored = 0
         db = SessionLocal()
         try:
-            for block_num in range(start_block, latest + 1):
-                txs = self.fetch_block_transactions(block_num)
-                stored = self.store_transactions(db, txs)
-                total_txs += len(txs)
-                total_stored += stored
-                logger.info(f"Block {block_num}: {len(txs)} txs fetched, {stored} new stored")
-                time.sleep(0.15)  # Rate limit protection
+            fetched = self.fetch_blocks_batch(list(range(start_block, latest + 1)))
+            all_txs = [tx for txs in fetched.values() for tx in txs]
+            total_txs = len(all_txs)
+            # One INSERT and one commit for the whole range
+            total_stored = self.store_transactions(db, all_txs)
+            logger.info(
+                f"Blocks {start_block}-{latest}: {total_txs} txs fetched, {total_stored} new stored"
+            )
 
             self.last_processed_block = latest
             self.total_blocks_processed += n_blocks
@@ -240,6 +468,76 @@ class BlockchainService:
 
     # ── Background polling ────────────────────────────────────────────────────
 
+    async def _ingest_through(self, latest: int, callback: Optional[Callable] = None):
+        """
+        Ingest every block after last_processed_block up to `latest`, then call
+        callback(latest) if anything new was stored.
+        """
+        if self.last_processed_block is None:
+            self.last_processed_block = latest - 1
+        if latest <= self.last_processed_block:
+            return
+
+        start = self.last_processed_block + 1
+        end = latest
+
+        fetched = await self.fetch_blocks_async(list(range(start, end + 1)))
+
+        def store_blocks():
+            all_txs = [tx for txs in fetched.values() for tx in txs]
+            db = SessionLocal()
+            try:
+                stored = self.store_transactions(db, all_txs)
+            finally:
+                db.close()
+            logger.info(f"Polled blocks {start}-{end}: {len(all_txs)} txs, {stored} new stored")
+            return stored
+
+        total = await asyncio.to_thread(store_blocks)
+        self.last_processed_block = latest
+        self.total_blocks_processed += (end - start + 1)
+
+        if callback and total > 0:
+            try:
+                await callback(latest)
+            except Exception as cb_err:
+                logger.error(f"Post-block callback error: {cb_err}")
+
+    async def subscribe_heads(self, callback: Optional[Callable] = None):
+        """
+        Follow the chain head over a WebSocket eth_subscribe("newHeads") feed
+        (ETH_WS_URL) instead of polling. Each pushed head ingests the blocks
+        since the last one processed. Falls back to start_polling when no
+        WebSocket URL is configured, when HTTP RPC is unavailable, or after
+        repeated subscription failures.
+        """
+        if not ETH_WS_URL or not self.is_connected or self._simulation_mode:
+            return await self.start_polling(callback)
+
+        self._polling = True
+        init_db()
+        failures = 0
+
+        while self._polling:
+            try:
+                async with AsyncWeb3(WebSocketProvider(ETH_WS_URL)) as w3:
+                    await w3.eth.subscribe("newHeads")
+                    logger.info(f"Subscribed to newHeads via {ETH_WS_URL[:50]}")
+                    failures = 0
+                    async for message in w3.socket.process_subscriptions():
+                        if not self._polling:
+                            break
+                        await self._ingest_through(_as_int(message["result"]["number"]), callback)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                logger.error(f"newHeads subscription error (#{failures}): {e}")
+                if failures >= MAX_CONSECUTIVE_ERRORS:
+                    logger.warning("WebSocket subscription keeps failing. Falling back to HTTP polling.")
+                    return await self.start_polling(callback)
+                await asyncio.sleep(5)
+
     async def start_polling(self, callback: Optional[Callable] = None):
         """
         Continuously poll for new blocks in the background.
@@ -260,36 +558,8 @@ class BlockchainService:
                     continue
 
                 latest = self.get_latest_block_number()
-                if self.last_processed_block is None:
-                    self.last_processed_block = latest - 1
-
-                if latest > self.last_processed_block:
-                    start = self.last_processed_block + 1
-                    end = latest
-
-                    def process_blocks():
-                        db = SessionLocal()
-                        total_stored = 0
-                        try:
-                            for block_num in range(start, end + 1):
-                                txs = self.fetch_block_transactions(block_num)
-                                stored = self.store_transactions(db, txs)
-                                total_stored += stored
-                                logger.info(f"Polled block {block_num}: {len(txs)} txs, {stored} new stored")
-                        finally:
-                            db.close()
-                        return total_stored
-
-                    total = await asyncio.to_thread(process_blocks)
-                    self.last_processed_block = latest
-                    self.total_blocks_processed += (end - start + 1)
-                    consecutive_errors = 0
-
-                    if callback and total > 0:
-                        try:
-                            await callback(latest)
-                        except Exception as cb_err:
-                            logger.error(f"Post-block callback error: {cb_err}")
+                await self._ingest_through(latest, callback)
+                consecutive_errors = 0
 
             except Exception as e:
                 consecutive_errors += 1
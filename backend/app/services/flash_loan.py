@@ -5,14 +5,18 @@ with near-equal values.
 """
 
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
+import numpy as np
+from sqlalchemy import func, literal_column, select, union_all
 from sqlalchemy.orm import Session
 from app.database import Transaction
 
 logger = logging.getLogger("chainwatch.flash_loan")
 
+MAX_TX_HASHES = 10  # Sample tx hashes reported per flagged event
+
 
 class FlashLoanDetector:
     """Detects flash-loan-like patterns in transaction data."""
@@ -26,6 +30,65 @@ class FlashLoanDetector:
         self.value_tolerance = value_tolerance
         self.min_value_eth = min_value_eth
 
+    def _flag_blocks(
+        self, db: Session, wallet: Optional[str] = None
+    ) -> List[Tuple[int, str, float, float, float]]:
+        """
+        (block, wallet, inflow, outflow, diff_ratio) for every block where a
+        wallet moved near-equal, significant ETH in both directions.
+        With `wallet`, only that wallet's transactions are scanned.
+        """
+        # Per-(block, wallet) inflow/outflow summed in the database; only
+        # pairs with significant flow in both directions come back.
+        out_legs = select(
+            Transaction.id.label("tx_id"),
+            Transaction.block_number.label("block_number"),
+            Transaction.from_address.label("wallet"),
+            literal_column("0.0").label("inflow"),
+            Transaction.value_eth.label("outflow"),
+        )
+        in_legs = select(
+            Transaction.id,
+            Transaction.block_number,
+            Transaction.to_address,
+            Transaction.value_eth,
+            literal_column("0.0"),
+        ).where(Transaction.to_address.is_not(None))
+        if wallet is not None:
+            out_legs = out_legs.where(Transaction.from_address == wallet)
+            in_legs = in_legs.where(Transaction.to_address == wallet)
+        legs = union_all(out_legs, in_legs).subquery()
+
+        inflow_sum = func.sum(legs.c.inflow)
+        outflow_sum = func.sum(legs.c.outflow)
+        candidates = db.execute(
+            select(
+                legs.c.block_number,
+                legs.c.wallet,
+                inflow_sum.label("inflow"),
+                outflow_sum.label("outflow"),
+            )
+            .group_by(legs.c.block_number, legs.c.wallet)
+            .having(inflow_sum >= self.min_value_eth, outflow_sum >= self.min_value_eth)
+            # first-seen order: by block, then the wallet's first tx in it
+            .order_by(legs.c.block_number, func.min(legs.c.tx_id))
+        ).all()
+
+        if not candidates:
+            return []
+
+        # Relative inflow/outflow difference for all candidates in one pass
+        inflow = np.fromiter((row[2] for row in candidates), dtype=np.float64, count=len(candidates))
+        outflow = np.fromiter((row[3] for row in candidates), dtype=np.float64, count=len(candidates))
+        max_val = np.maximum(inflow, outflow)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diff_ratio = np.where(max_val > 0, np.abs(inflow - outflow) / max_val, 1.0)
+
+        return [
+            (candidates[i][0], candidates[i][1], candidates[i][2], candidates[i][3], float(diff_ratio[i]))
+            for i in np.flatnonzero(diff_ratio <= self.value_tolerance)
+        ]
+
     def detect(self, db: Session) -> List[Dict[str, Any]]:
         """
         Scan transactions for flash-loan-like patterns.
@@ -34,56 +97,47 @@ class FlashLoanDetector:
 
         Returns list of suspicious events.
         """
-        transactions = db.query(Transaction).order_by(Transaction.block_number).all()
-
-        # Group by (block_number, wallet)
-        block_wallet: Dict[int, Dict[str, Dict[str, float]]] = defaultdict(
-            lambda: defaultdict(lambda: {"inflow": 0.0, "outflow": 0.0, "tx_hashes": []})
-        )
-
-        for tx in transactions:
-            block = tx.block_number
-            sender = tx.from_address
-            receiver = tx.to_address
-
-            block_wallet[block][sender]["outflow"] += tx.value_eth
-            block_wallet[block][sender]["tx_hashes"].append(tx.tx_hash)
-
-            if receiver:
-                block_wallet[block][receiver]["inflow"] += tx.value_eth
-                block_wallet[block][receiver]["tx_hashes"].append(tx.tx_hash)
+        flagged = self._flag_blocks(db)
+
+        # Tx hashes only for the flagged (block, wallet) pairs
+        tx_hashes: Dict[Tuple[int, str], Dict[str, None]] = defaultdict(dict)
+        if flagged:
+            keys = {(block_num, wallet) for block_num, wallet, *_ in flagged}
+            block_txs = db.execute(
+                select(
+                    Transaction.block_number,
+                    Transaction.from_address,
+                    Transaction.to_address,
+                    Transaction.tx_hash,
+                )
+                .where(Transaction.block_number.in_({block_num for block_num, _ in keys}))
+                .order_by(Transaction.id)
+            ).all()
+            for block_num, sender, receiver, tx_hash in block_txs:
+                for wallet in (sender, receiver):
+                    if (block_num, wallet) in keys:
+                        # Ordered set, capped – stop collecting once full
+                        hashes = tx_hashes[(block_num, wallet)]
+                        if len(hashes) < MAX_TX_HASHES:
+                            hashes[tx_hash] = None
 
         suspects: List[Dict[str, Any]] = []
-
-        for block_num, wallets in block_wallet.items():
-            for wallet, flows in wallets.items():
-                inflow = flows["inflow"]
-                outflow = flows["outflow"]
-
-                # Must have both significant inflow AND outflow in same block
-                if inflow < self.min_value_eth or outflow < self.min_value_eth:
-                    continue
-
-                max_val = max(inflow, outflow)
-                min_val = min(inflow, outflow)
-                diff_ratio = (max_val - min_val) / max_val if max_val > 0 else 1.0
-
-                if diff_ratio <= self.value_tolerance:
-                    score = (1 - diff_ratio) * 100
-                    suspects.append({
-                        "wallet": wallet,
-                        "block_number": block_num,
-                        "inflow_eth": round(inflow, 6),
-                        "outflow_eth": round(outflow, 6),
-                        "value_difference_pct": round(diff_ratio * 100, 2),
-                        "flash_loan_score": round(score, 2),
-                        "tx_hashes": list(set(flows["tx_hashes"]))[:10],
-                        "explanation": (
-                            f"Wallet received {inflow:.4f} ETH and sent {outflow:.4f} ETH "
-                            f"in block {block_num} (diff {diff_ratio*100:.1f}%). "
-                            f"Pattern consistent with flash-loan activity."
-                        ),
-                    })
+        for block_num, wallet, inflow, outflow, diff_ratio in flagged:
+            score = (1 - diff_ratio) * 100
+            suspects.append({
+                "wallet": wallet,
+                "block_number": block_num,
+                "inflow_eth": round(inflow, 6),
+                "outflow_eth": round(outflow, 6),
+                "value_difference_pct": round(diff_ratio * 100, 2),
+                "flash_loan_score": round(score, 2),
+                "tx_hashes": list(tx_hashes[(block_num, wallet)]),
+                "explanation": (
+                    f"Wallet received {inflow:.4f} ETH and sent {outflow:.4f} ETH "
+                    f"in block {block_num} (diff {diff_ratio*100:.1f}%). "
+                    f"Pattern consistent with flash-loan activity."
+                ),
+            })
 
         suspects.sort(key=lambda x: x["flash_loan_score"], reverse=True)
         logger.info(f"Detected {len(suspects)} flash-loan-like events")
@@ -91,11 +145,11 @@ class FlashLoanDetector:
 
     def get_wallet_flash_score(self, db: Session, address: str) -> float:
         """Get the highest flash-loan score for a specific wallet."""
-        detections = self.detect(db)
-        wallet_detections = [d for d in detections if d["wallet"] == address]
-        if not wallet_detections:
+        # Only this wallet's rows (address indexes) instead of a full detect()
+        flagged = self._flag_blocks(db, address)
+        if not flagged:
             return 0.0
-        return max(d["flash_loan_score"] for d in wallet_detections)
+        return max(round((1 - diff_ratio) * 100, 2) for *_, diff_ratio in flagged)
 
 
 # Singleton
@@ -6,16 +6,25 @@ PageRank, and hub/authority classification.
 """
 
 import logging
-from typing import List, Dict, Any, Tuple, Set
+from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
 import networkx as nx
+import numpy as np
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
 from app.database import Transaction
 
+try:  # optional: multithreaded C++ betweenness estimation
+    import networkit as nk
+except ImportError:
+    nk = None
+
 logger = logging.getLogger("chainwatch.graph")
 
+BETWEENNESS_SAMPLES = 100  # Source nodes sampled for approximate betweenness
+
 
 class GraphAnalyzer:
     """Builds and analyses directed wallet interaction graphs."""
@@ -26,6 +35,14 @@ class GraphAnalyzer:
         self._pagerank: Dict[str, float] = {}
         self._hub_scores: Dict[str, float] = {}
         self._authority_scores: Dict[str, float] = {}
+        # Edge list as parallel arrays of node indices (node order == graph order)
+        self._node_index: Dict[str, int] = {}
+        self._src: np.ndarray = np.empty(0, dtype=np.int32)
+        self._dst: np.ndarray = np.empty(0, dtype=np.int32)
+        # Whole-graph metrics computed on first use; cleared whenever the graph changes
+        self._metric_cache: Dict[str, Any] = {}
+        # max(Transaction.id) the graph was built from; None = never built
+        self._data_epoch: Optional[int] = None
 
     def build_graph(self, db: Session) -> Dict[str, Any]:
         """
@@ -33,49 +50,155 @@ class GraphAnalyzer:
         Edge weight = total ETH transferred between two wallets.
         Edge count = number of transactions.
         Also computes communities, PageRank, and HITS scores.
+        Skipped when no transactions were stored since the last build.
         """
-        self.graph = nx.DiGraph()
-        transactions = db.query(Transaction).all()
+        epoch = db.scalar(select(func.max(Transaction.id)))
+        if epoch is not None and epoch == self._data_epoch:
+            logger.info(f"Graph unchanged since transaction #{epoch}, not rebuilding")
+            return self._summary()
 
-        edge_data: Dict[Tuple[str, str], Dict] = defaultdict(
-            lambda: {"weight": 0.0, "count": 0, "blocks": set(), "gas_total": 0.0}
+        self.graph = nx.DiGraph()
+        self._metric_cache = {}
+
+        # Stream only the needed columns in chunks (server-side cursor on
+        # Postgres) so peak memory is bounded by the edge set, not the tx table.
+        rows = db.execute(
+            select(
+                Transaction.from_address,
+                Transaction.to_address,
+                Transaction.value_eth,
+                Transaction.block_number,
+                Transaction.gas_price_gwei,
+            )
+            .where(Transaction.to_address.is_not(None))
+            .execution_options(yield_per=10_000, stream_results=True)
         )
 
-        for tx in transactions:
-            if not tx.to_address:
-                continue
-            key = (tx.from_address, tx.to_address)
-            edge_data[key]["weight"] += tx.value_eth
-            edge_data[key]["count"] += 1
-            edge_data[key]["blocks"].add(tx.block_number)
-            edge_data[key]["gas_total"] += tx.gas_price_gwei
-
-        for (src, dst), data in edge_data.items():
-            self.graph.add_edge(
-                src, dst,
-                weight=data["weight"],
-                count=data["count"],
-                blocks=len(data["blocks"]),
-                avg_gas=data["gas_total"] / data["count"] if data["count"] > 0 else 0,
-            )
+        # Accumulate straight onto the graph's edge attribute dicts
+        graph = self.graph
+        for from_address, to_address, value_eth, block_number, gas_price_gwei in rows:
+            data = graph.get_edge_data(from_address, to_address)
+            if data is None:
+                graph.add_edge(
+                    from_address, to_address,
+                    weight=value_eth,
+                    count=1,
+                    blocks={block_number},
+                    gas_total=gas_price_gwei,
+                )
+            else:
+                data["weight"] += value_eth
+                data["count"] += 1
+                data["blocks"].add(block_number)
+                data["gas_total"] += gas_price_gwei
+
+        # One pass to finalise attributes and fill the edge index arrays
+        node_index = {node: i for i, node in enumerate(graph)}
+        src_idx = np.empty(graph.number_of_edges(), dtype=np.int32)
+        dst_idx = np.empty(graph.number_of_edges(), dtype=np.int32)
+        for i, (src, dst, data) in enumerate(graph.edges(data=True)):
+            data["blocks"] = len(data["blocks"])
+            data["avg_gas"] = data.pop("gas_total") / data["count"]
+            src_idx[i] = node_index[src]
+            dst_idx[i] = node_index[dst]
+        self._node_index, self._src, self._dst = node_index, src_idx, dst_idx
 
         # Compute advanced metrics
         self._compute_communities()
         self._compute_pagerank()
         self._compute_hits()
+        self._data_epoch = epoch
 
+        summary = self._summary()
         logger.info(
-            f"Graph built: {self.graph.number_of_nodes()} nodes, "
-            f"{self.graph.number_of_edges()} edges, "
-            f"{len(set(self._communities.values()))} communities"
+            f"Graph built: {summary['nodes']} nodes, "
+            f"{summary['edges']} edges, "
+            f"{summary['communities']} communities"
         )
+        return summary
 
+    def _summary(self) -> Dict[str, Any]:
         return {
             "nodes": self.graph.number_of_nodes(),
             "edges": self.graph.number_of_edges(),
             "communities": len(set(self._communities.values())),
         }
 
+    def export_state(self) -> Dict[str, Any]:
+        """Picklable snapshot of the built graph and its metrics."""
+        return {
+            "graph": self.graph,
+            "communities": self._communities,
+            "pagerank": self._pagerank,
+            "hub_scores": self._hub_scores,
+            "authority_scores": self._authority_scores,
+            "node_index": self._node_index,
+            "src": self._src,
+            "dst": self._dst,
+            "data_epoch": self._data_epoch,
+        }
+
+    def load_state(self, state: Dict[str, Any]):
+        """Adopt a snapshot produced by export_state (e.g. in a worker process)."""
+        self.graph = state["graph"]
+        self._communities = state["communities"]
+        self._pagerank = state["pagerank"]
+        self._hub_scores = state["hub_scores"]
+        self._authority_scores = state["authority_scores"]
+        self._node_index = state["node_index"]
+        self._src = state["src"]
+        self._dst = state["dst"]
+        self._data_epoch = state["data_epoch"]
+        self._metric_cache = {}
+
+    def _cached_metric(self, name: str, compute):
+        """Compute a whole-graph metric once per graph build."""
+        if name not in self._metric_cache:
+            self._metric_cache[name] = compute()
+        return self._metric_cache[name]
+
+    def _degrees(self) -> Dict[str, Tuple[int, int]]:
+        """(in_degree, out_degree) per node, counted from the edge arrays."""
+        def compute():
+            n = len(self._node_index)
+            in_deg = np.bincount(self._dst, minlength=n).tolist()
+            out_deg = np.bincount(self._src, minlength=n).tolist()
+            return dict(zip(self._node_index, zip(in_deg, out_deg)))
+        return self._cached_metric("degrees", compute)
+
+    def _degree_centrality(self) -> Dict[str, float]:
+        def compute():
+            n = len(self._node_index)
+            if n <= 1:
+                return {node: 1.0 for node in self._node_index}
+            total = np.bincount(self._dst, minlength=n) + np.bincount(self._src, minlength=n)
+            return dict(zip(self._node_index, (total * (1.0 / (n - 1))).tolist()))
+        return self._cached_metric("degree", compute)
+
+    def _betweenness_centrality(self) -> Dict[str, float]:
+        def compute():
+            k = min(BETWEENNESS_SAMPLES, self.graph.number_of_nodes())
+            if nk is not None:
+                try:
+                    # nx2nk numbers nodes in graph order
+                    estimate = nk.centrality.EstimateBetweenness(
+                        nk.nxadapter.nx2nk(self.graph), k, normalized=True, parallel_flag=True
+                    )
+                    estimate.run()
+                    return dict(zip(self.graph.nodes(), estimate.scores()))
+                except Exception as e:
+                    logger.warning(f"networkit betweenness failed, using NetworkX: {e}")
+            try:
+                return nx.betweenness_centrality(self.graph, k=k)
+            except Exception:
+                return {n: 0.0 for n in self.graph.nodes()}
+        return self._cached_metric("betweenness", compute)
+
+    def _max_pagerank(self) -> float:
+        return self._cached_metric(
+            "max_pagerank", lambda: max(self._pagerank.values()) if self._pagerank else 1.0
+        )
+
     def _compute_communities(self):
         """Detect communities using greedy modularity on undirected projection."""
         try:
@@ -111,13 +234,17 @@ class GraphAnalyzer:
     def detect_cycles(self, max_length: int = 5) -> List[List[str]]:
         """
         Detect short cycles (length <= max_length) indicating circular trading.
-        Returns list of cycles (lists of wallet addresses).
+        Returns list of cycles (lists of wallet addresses), cached per graph build.
         """
+        return self._cached_metric(f"cycles:{max_length}", lambda: self._detect_cycles(max_length))
+
+    def _detect_cycles(self, max_length: int) -> List[List[str]]:
         cycles: List[List[str]] = []
         try:
-            all_cycles = list(nx.simple_cycles(self.graph))
-            for cycle in all_cycles:
-                if 2 <= len(cycle) <= max_length:
+            # length_bound prunes the search at max_length instead of
+            # enumerating every cycle in the graph; stop at the cap.
+            for cycle in nx.simple_cycles(self.graph, length_bound=max_length):
+                if len(cycle) >= 2:
                     cycles.append(cycle)
                 if len(cycles) >= 500:  # increased cap for more data
                     break
@@ -134,55 +261,50 @@ class GraphAnalyzer:
         - Similar values in both directions
         - Short time intervals
 
-        Returns list of suspicious wallet pairs with details.
+        Returns list of suspicious wallet pairs with details, cached per graph build.
         """
+        return self._cached_metric("wash_pairs", self._detect_wash_trading)
+
+    def _detect_wash_trading(self) -> List[Dict[str, Any]]:
         suspicious_pairs: List[Dict[str, Any]] = []
 
+        succ = self.graph.succ
         for u, v, data_uv in self.graph.edges(data=True):
-            if self.graph.has_edge(v, u):
-                data_vu = self.graph[v][u]
-
-                val_uv = data_uv.get("weight", 0)
-                val_vu = data_vu.get("weight", 0)
-
-                if val_uv == 0 and val_vu == 0:
-                    continue
-
-                max_val = max(val_uv, val_vu)
-                min_val = min(val_uv, val_vu)
-                similarity = min_val / max_val if max_val > 0 else 0
-
-                if similarity > 0.7:  # slightly more sensitive threshold
-                    # Check if they're in the same community (more suspicious)
-                    same_community = self._communities.get(u, -1) == self._communities.get(v, -2)
-                    community_bonus = 10 if same_community else 0
-
-                    suspicious_pairs.append({
-                        "wallet_a": u,
-                        "wallet_b": v,
-                        "value_a_to_b": round(val_uv, 6),
-                        "value_b_to_a": round(val_vu, 6),
-                        "value_similarity": round(similarity, 4),
-                        "tx_count_a_to_b": data_uv.get("count", 0),
-                        "tx_count_b_to_a": data_vu.get("count", 0),
-                        "same_community": same_community,
-                        "suspicion_score": round(
-                            similarity * 50 + min(data_uv["count"] + data_vu["count"], 10) * 5 + community_bonus, 2
-                        ),
-                    })
-
-        # Deduplicate (A,B) and (B,A)
-        seen: Set[Tuple[str, str]] = set()
-        unique_pairs = []
-        for pair in suspicious_pairs:
-            key = tuple(sorted([pair["wallet_a"], pair["wallet_b"]]))
-            if key not in seen:
-                seen.add(key)
-                unique_pairs.append(pair)
-
-        unique_pairs.sort(key=lambda x: x["suspicion_score"], reverse=True)
-        logger.info(f"Detected {len(unique_pairs)} potential wash-trading pairs")
-        return unique_pairs
+            # Visit each reciprocal pair once, from its lower-keyed wallet
+            if u >= v:
+                continue
+            data_vu = succ[v].get(u)
+            if data_vu is None:
+                continue
+
+            val_uv = data_uv.get("weight", 0)
+            val_vu = data_vu.get("weight", 0)
+
+            max_val = max(val_uv, val_vu)
+            similarity = min(val_uv, val_vu) / max_val if max_val > 0 else 0
+
+            if similarity > 0.7:  # slightly more sensitive threshold
+                # Check if they're in the same community (more suspicious)
+                same_community = self._communities.get(u, -1) == self._communities.get(v, -2)
+                community_bonus = 10 if same_community else 0
+
+                suspicious_pairs.append({
+                    "wallet_a": u,
+                    "wallet_b": v,
+                    "value_a_to_b": round(val_uv, 6),
+                    "value_b_to_a": round(val_vu, 6),
+                    "value_similarity": round(similarity, 4),
+                    "tx_count_a_to_b": data_uv.get("count", 0),
+                    "tx_count_b_to_a": data_vu.get("count", 0),
+                    "same_community": same_community,
+                    "suspicion_score": round(
+                        similarity * 50 + min(data_uv["count"] + data_vu["count"], 10) * 5 + community_bonus, 2
+                    ),
+                })
+
+        suspicious_pairs.sort(key=lambda x: x["suspicion_score"], reverse=True)
+        logger.info(f"Detected {len(suspicious_pairs)} potential wash-trading pairs")
+        return suspicious_pairs
 
     def compute_centrality(self, top_n: int = 50) -> List[Dict[str, Any]]:
         """
@@ -192,13 +314,8 @@ class GraphAnalyzer:
         if self.graph.number_of_nodes() == 0:
             return []
 
-        degree_cent = nx.degree_centrality(self.graph)
-        try:
-            between_cent = nx.betweenness_centrality(
-                self.graph, k=min(100, self.graph.number_of_nodes())
-            )
-        except Exception:
-            between_cent = {n: 0.0 for n in self.graph.nodes()}
+        degree_cent = self._degree_centrality()
+        between_cent = self._betweenness_centrality()
 
         combined = []
         for node in self.graph.nodes():
@@ -236,10 +353,11 @@ class GraphAnalyzer:
         if self.graph.number_of_nodes() == 0:
             return {"nodes": [], "links": []}
 
-        degree_cent = nx.degree_centrality(self.graph)
+        degree_cent = self._degree_centrality()
+        degrees = self._degrees()
 
         # Determine max pagerank for normalization
-        max_pr = max(self._pagerank.values()) if self._pagerank else 1.0
+        max_pr = self._max_pagerank()
         max_pr = max_pr if max_pr > 0 else 1.0
 
         nodes = []
@@ -247,9 +365,8 @@ class GraphAnalyzer:
             pr = self._pagerank.get(node, 0)
             hub = self._hub_scores.get(node, 0)
             auth = self._authority_scores.get(node, 0)
-            deg = self.graph.degree(node)
-            in_deg = self.graph.in_degree(node)
-            out_deg = self.graph.out_degree(node)
+            in_deg, out_deg = degrees[node]
+            deg = in_deg + out_deg
 
             # Classify node role
             if hub > auth * 1.5 and hub > 0.001:
@@ -305,33 +422,42 @@ class GraphAnalyzer:
         Compute a graph-based suspicion score (0-100) for a single wallet.
         Based on cycle involvement + centrality + bidirectional transfer ratio + PageRank.
         """
-        if address not in self.graph:
-            return 0.0
-
-        score = 0.0
-
-        # Centrality component
-        degree_cent = nx.degree_centrality(self.graph).get(address, 0)
-        score += degree_cent * 25
-
-        # PageRank component (high PageRank = important node)
-        pr = self._pagerank.get(address, 0)
-        max_pr = max(self._pagerank.values()) if self._pagerank else 1.0
-        score += (pr / max_pr if max_pr > 0 else 0) * 15
-
-        # Bidirectional relationships
-        neighbors = set(self.graph.successors(address)) | set(self.graph.predecessors(address))
-        bidirectional = 0
-        for nbr in neighbors:
-            if self.graph.has_edge(address, nbr) and self.graph.has_edge(nbr, address):
-                bidirectional += 1
-        if neighbors:
-            score += (bidirectional / len(neighbors)) * 35
-
-        # High connection count
-        score += min(self.graph.degree(address), 30) * 1.0
-
-        return min(round(score, 2), 100.0)
+        return self.get_all_wallet_graph_scores().get(address, 0.0)
+
+    def get_all_wallet_graph_scores(self) -> Dict[str, float]:
+        """Graph suspicion score for every wallet, computed once per graph build."""
+        return self._cached_metric("wallet_scores", self._compute_wallet_graph_scores)
+
+    def _compute_wallet_graph_scores(self) -> Dict[str, float]:
+        degree_cent = self._degree_centrality()
+        degrees = self._degrees()
+        max_pr = self._max_pagerank()
+        succ = self.graph.succ
+        pred = self.graph.pred
+
+        scores: Dict[str, float] = {}
+        for address in self.graph.nodes():
+            score = 0.0
+
+            # Centrality component
+            score += degree_cent.get(address, 0) * 25
+
+            # PageRank component (high PageRank = important node)
+            pr = self._pagerank.get(address, 0)
+            score += (pr / max_pr if max_pr > 0 else 0) * 15
+
+            # Bidirectional relationships: neighbours with edges both ways
+            out_nbrs = succ[address].keys()
+            in_nbrs = pred[address].keys()
+            neighbors = out_nbrs | in_nbrs
+            if neighbors:
+                score += (len(out_nbrs & in_nbrs) / len(neighbors)) * 35
+
+            # High connection count
+            score += min(sum(degrees[address]), 30) * 1.0
+
+            scores[address] = min(round(score, 2), 100.0)
+        return scores
 
 
 # Singleton
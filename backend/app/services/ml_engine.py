@@ -4,35 +4,64 @@ Uses Isolation Forest for anomaly detection and KMeans for behavioural clusterin
 """
 
 import logging
+import os
+import threading
 import numpy as np
-from typing import List, Dict, Any, Tuple
-from collections import defaultdict
-from datetime import datetime
+import joblib
+from joblib import parallel_config
+from typing import List, Dict, Any, Optional, Tuple
 
 from sklearn.ensemble import IsolationForest
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
+from sqlalchemy import func, literal_column, select, union, union_all
 from sqlalchemy.orm import Session
 
-from app.config import ANOMALY_CONTAMINATION, N_CLUSTERS
-from app.database import SessionLocal, Transaction, WalletProfile
+from app.config import (
+    ANOMALY_CONTAMINATION, DATABASE_URL, IFOREST_MAX_SAMPLES, IFOREST_N_ESTIMATORS,
+    ML_MODEL_PATH, N_CLUSTERS,
+)
+from app.database import SessionLocal, Transaction, WalletProfile, upsert
 
 logger = logging.getLogger("chainwatch.ml")
 
+MINIBATCH_KMEANS_MIN_WALLETS = 100_000  # Above this, cluster with MiniBatchKMeans
+
 
 class MLEngine:
     """Machine learning engine for anomaly detection and clustering."""
 
     def __init__(self):
         self.scaler = StandardScaler()
-        self.isolation_forest = IsolationForest(
+        self.isolation_forest = self._new_isolation_forest()
+        self.kmeans = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
+        self._is_trained = False
+        # (max transaction id, extract_features result, digest of that result) –
+        # reused until new rows land
+        self._feature_cache: Optional[Tuple[Optional[int], Tuple, str]] = None
+        # What the current models were fitted on; see _fit_fingerprint
+        self._trained_on: Optional[Tuple] = None
+        self._load_attempted = False
+        # Models loaded from disk and not yet refitted in this process; see train_and_predict
+        self._warm_start = False
+        self._background_fit: Optional[threading.Thread] = None
+        # Guards swapping (scaler, isolation_forest, kmeans) as one set
+        self._model_lock = threading.Lock()
+
+    @staticmethod
+    def _new_isolation_forest() -> IsolationForest:
+        return IsolationForest(
             contamination=ANOMALY_CONTAMINATION,
             random_state=42,
-            n_estimators=150,
-            max_samples="auto",
+            n_estimators=IFOREST_N_ESTIMATORS,
+            max_samples=IFOREST_MAX_SAMPLES,
+            n_jobs=-1,
         )
-        self.kmeans = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
-        self._is_trained = False
+
+    def _models(self) -> Tuple[StandardScaler, IsolationForest, KMeans]:
+        """Consistent snapshot of the current scaler and models."""
+        with self._model_lock:
+            return self.scaler, self.isolation_forest, self.kmeans
 
     def extract_features(self, db: Session) -> Tuple[List[str], np.ndarray, List[Dict]]:
         """
@@ -49,129 +78,324 @@ class MLEngine:
         6 - tx_frequency (txs per hour over active period)
         7 - burst_score (max txs in any single block)
         """
-        transactions = db.query(Transaction).order_by(Transaction.timestamp.asc()).all()
-        if not transactions:
-            return [], np.array([]), []
-
-        wallet_data: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
-            "sent_values": [],
-            "received_values": [],
-            "counterparties": set(),
-            "timestamps": [],
-            "blocks": defaultdict(int),
-        })
-
-        for tx in transactions:
-            sender = tx.from_address
-            receiver = tx.to_address or ""
-
-            # Sender stats
-            wallet_data[sender]["sent_values"].append(tx.value_eth)
-            if receiver:
-                wallet_data[sender]["counterparties"].add(receiver)
-            wallet_data[sender]["timestamps"].append(tx.timestamp)
-            wallet_data[sender]["blocks"][tx.block_number] += 1
-
-            # Receiver stats
-            if receiver:
-                wallet_data[receiver]["received_values"].append(tx.value_eth)
-                wallet_data[receiver]["counterparties"].add(sender)
-                wallet_data[receiver]["timestamps"].append(tx.timestamp)
-                wallet_data[receiver]["blocks"][tx.block_number] += 1
-
-        addresses = []
-        features = []
-        raw_profiles = []
-
-        for addr, data in wallet_data.items():
-            total_sent = sum(data["sent_values"]) if data["sent_values"] else 0.0
-            total_received = sum(data["received_values"]) if data["received_values"] else 0.0
-            tx_count = len(data["sent_values"]) + len(data["received_values"])
-            avg_value = (total_sent + total_received) / max(tx_count, 1)
-            unique_cp = len(data["counterparties"])
-
-            inflow = total_received if total_received > 0 else 0.001
-            outflow = total_sent if total_sent > 0 else 0.001
-            io_ratio = inflow / outflow
-
-            # Tx frequency: txs per hour over active window
-            if len(data["timestamps"]) >= 2:
-                sorted_ts = sorted(data["timestamps"])
-                span_hours = max((sorted_ts[-1] - sorted_ts[0]).total_seconds() / 3600, 0.01)
-                tx_freq = tx_count / span_hours
-            else:
-                tx_freq = 0.0
-
-            # Burst score: max txs in a single block
-            burst = max(data["blocks"].values()) if data["blocks"] else 0
-
-            profile = {
+        # Every transaction is an outgoing leg for its sender and, when it has
+        # a receiver, an incoming leg for the receiver. Per-wallet reductions
+        # run in the database; Python only sees one row per wallet.
+        out_legs = select(
+            Transaction.id.label("tx_id"),
+            Transaction.from_address.label("wallet"),
+            Transaction.block_number.label("block_number"),
+            Transaction.timestamp.label("timestamp"),
+            Transaction.value_eth.label("sent"),
+            literal_column("0.0").label("received"),
+        )
+        in_legs = select(
+            Transaction.id,
+            Transaction.to_address,
+            Transaction.block_number,
+            Transaction.timestamp,
+            literal_column("0.0"),
+            Transaction.value_eth,
+        ).where(Transaction.to_address.is_not(None))
+        legs = union_all(out_legs, in_legs).subquery()
+
+        totals = db.execute(
+            select(
+                legs.c.wallet,
+                func.count(),
+                func.sum(legs.c.sent),
+                func.sum(legs.c.received),
+                func.min(legs.c.timestamp),
+                func.max(legs.c.timestamp),
+            )
+            .group_by(legs.c.wallet)
+            # first-seen order, as when scanning transactions by timestamp
+            .order_by(func.min(legs.c.timestamp), func.min(legs.c.tx_id))
+        ).all()
+        if not totals:
+            return [], np.array([], dtype=np.float32), []
+
+        # Burst: most legs a wallet has in any single block
+        per_block = (
+            select(legs.c.wallet, func.count().label("n"))
+            .group_by(legs.c.wallet, legs.c.block_number)
+            .subquery()
+        )
+        bursts = dict(db.execute(
+            select(per_block.c.wallet, func.max(per_block.c.n)).group_by(per_block.c.wallet)
+        ).all())
+
+        # Distinct counterparties across both directions
+        with_receiver = Transaction.to_address.is_not(None)
+        pairs = union(
+            select(
+                Transaction.from_address.label("wallet"),
+                Transaction.to_address.label("counterparty"),
+            ).where(with_receiver),
+            select(Transaction.to_address, Transaction.from_address).where(with_receiver),
+        ).subquery()
+        counterparties = dict(db.execute(
+            select(pairs.c.wallet, func.count()).group_by(pairs.c.wallet)
+        ).all())
+
+        # Feature columns computed over whole arrays, one element per wallet
+        n = len(totals)
+        addresses = [row[0] for row in totals]
+        tx_count = np.fromiter((row[1] for row in totals), dtype=np.float64, count=n)
+        total_sent = np.fromiter((row[2] for row in totals), dtype=np.float64, count=n)
+        total_received = np.fromiter((row[3] for row in totals), dtype=np.float64, count=n)
+        first_ts = np.array([row[4] for row in totals], dtype="datetime64[us]")
+        last_ts = np.array([row[5] for row in totals], dtype="datetime64[us]")
+        unique_cp = np.fromiter(
+            (counterparties.get(addr, 0) for addr in addresses), dtype=np.float64, count=n
+        )
+        burst = np.fromiter((bursts.get(addr, 0) for addr in addresses), dtype=np.float64, count=n)
+
+        avg_value = (total_sent + total_received) / np.maximum(tx_count, 1)
+        inflow = np.where(total_received > 0, total_received, 0.001)
+        outflow = np.where(total_sent > 0, total_sent, 0.001)
+        io_ratio = inflow / outflow
+
+        # Tx frequency: txs per hour over active window
+        span_hours = np.maximum((last_ts - first_ts) / np.timedelta64(1, "h"), 0.01)
+        tx_freq = np.where(tx_count >= 2, tx_count / span_hours, 0.0)
+
+        columns = (
+            tx_count, total_sent, total_received, avg_value,
+            unique_cp, io_ratio, tx_freq, burst,
+        )
+
+        # Fill a preallocated float32 matrix column by column (cast on write,
+        # no float64 stack + copy). float32 is what IsolationForest works in
+        # anyway; StandardScaler and KMeans keep it.
+        features = np.empty((n, len(columns)), dtype=np.float32)
+        for j, column in enumerate(columns):
+            features[:, j] = column
+
+        # Stored profiles keep the full float64 values
+        raw_profiles = [
+            {
                 "address": addr,
-                "tx_count": tx_count,
-                "total_value_sent": total_sent,
-                "total_value_received": total_received,
-                "avg_value": avg_value,
-                "unique_counterparties": unique_cp,
-                "inflow_outflow_ratio": io_ratio,
-                "tx_frequency": tx_freq,
-                "burst_score": float(burst),
+                "tx_count": int(row[0]),
+                "total_value_sent": row[1],
+                "total_value_received": row[2],
+                "avg_value": row[3],
+                "unique_counterparties": int(row[4]),
+                "inflow_outflow_ratio": row[5],
+                "tx_frequency": row[6],
+                "burst_score": row[7],
             }
+            for addr, *row in zip(addresses, *(column.tolist() for column in columns))
+        ]
 
-            addresses.append(addr)
-            features.append([
-                tx_count, total_sent, total_received, avg_value,
-                unique_cp, io_ratio, tx_freq, float(burst),
-            ])
-            raw_profiles.append(profile)
+        return addresses, features, raw_profiles
+
+    def _get_features(self, db: Session) -> Tuple[List[str], np.ndarray, List[Dict]]:
+        """extract_features, skipped when no transactions were added since the last call."""
+        key = db.scalar(select(func.max(Transaction.id)))
+        if self._feature_cache is None or self._feature_cache[0] != key:
+            addresses, X, raw_profiles = self.extract_features(db)
+            digest = joblib.hash((addresses, X))
+            self._feature_cache = (key, (addresses, X, raw_profiles), digest)
+        return self._feature_cache[1]
+
+    def _fit_fingerprint(self) -> Tuple:
+        """
+        Data and settings a fit depends on (call after _get_features).
+        max(Transaction.id) alone doesn't identify the data – a recreated DB can
+        reach the same id – so the digest of the feature matrix is included.
+        """
+        return (
+            DATABASE_URL, ANOMALY_CONTAMINATION, N_CLUSTERS,
+            IFOREST_N_ESTIMATORS, IFOREST_MAX_SAMPLES,
+            self._feature_cache[0], self._feature_cache[2],
+        )
 
-        return addresses, np.array(features), raw_profiles
+    # ── Model persistence ─────────────────────────────────────────────────────
+
+    def _load_models(self):
+        """Adopt models saved by a previous process (once per process)."""
+        self._load_attempted = True
+        if not ML_MODEL_PATH or not os.path.exists(ML_MODEL_PATH):
+            return
+        try:
+            saved = joblib.load(ML_MODEL_PATH)
+            self.scaler, self.isolation_forest, self.kmeans = saved["models"]
+            self._trained_on = saved["trained_on"]
+            self._is_trained = True
+            self._warm_start = True
+            logger.info(f"Loaded ML models from {ML_MODEL_PATH}")
+        except Exception as e:
+            logger.warning(f"Could not load ML models from {ML_MODEL_PATH}: {e}")
+
+    def _save_models(self):
+        if not ML_MODEL_PATH:
+            return
+        tmp_path = f"{ML_MODEL_PATH}.tmp"
+        try:
+            joblib.dump(
+                {"models": self._models(), "trained_on": self._trained_on},
+                tmp_path,
+                compress=3,
+            )
+            os.replace(tmp_path, ML_MODEL_PATH)  # readers never see a partial file
+        except Exception as e:
+            logger.warning(f"Could not save ML models to {ML_MODEL_PATH}: {e}")
 
     def train(self, db: Session) -> Dict[str, Any]:
         """
         Train Isolation Forest and KMeans on current transaction data.
         Returns training summary.
         """
-        addresses, X, raw_profiles = self.extract_features(db)
-        if len(addresses) < 5:
-            logger.warning("Not enough wallets to train. Need at least 5.")
-            return {"status": "insufficient_data", "wallets": len(addresses)}
-
-        X_scaled = self.scaler.fit_transform(X)
-
-        # Isolation Forest
-        self.isolation_forest.fit(X_scaled)
+        return self._fit(db)[0]
 
-        # KMeans – adjust n_clusters if needed
-        effective_k = min(N_CLUSTERS, len(addresses))
-        self.kmeans = KMeans(n_clusters=effective_k, random_state=42, n_init=10)
-        self.kmeans.fit(X_scaled)
-
-        self._is_trained = True
-        logger.info(f"ML models trained on {len(addresses)} wallets")
+    def _fit(self, db: Session) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """train(), also returning the scaled feature matrix when a fit ran."""
+        if not self._load_attempted:
+            self._load_models()
 
+        addresses, X, raw_profiles = self._get_features(db)
+        if len(addresses) < 5:
+            logger.warning("Not enough wallets to train. Need at least 5.")
+            return {"status": "insufficient_data", "wallets": len(addresses)}, None
+
+        # Nothing new since the current (possibly loaded) fit – keep it
+        fingerprint = self._fit_fingerprint()
+        if self._is_trained and self._trained_on == fingerprint:
+            logger.info(f"ML models already fitted on these {len(addresses)} wallets")
+            return {
+                "status": "trained",
+                "wallets": len(addresses),
+                "clusters": self.kmeans.n_clusters,
+            }, None
+
+        X_scaled = self._fit_models(X, fingerprint)
         return {
             "status": "trained",
             "wallets": len(addresses),
-            "clusters": effective_k,
-        }
+            "clusters": min(N_CLUSTERS, len(addresses)),
+        }, X_scaled
+
+    def _fit_models(self, X: np.ndarray, fingerprint: Tuple) -> np.ndarray:
+        """
+        Fit a fresh scaler, Isolation Forest and KMeans on X, then swap them in
+        together and persist them. Returns the scaled matrix.
+        """
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+
+        # Isolation Forest
+        isolation_forest = self._new_isolation_forest()
+        isolation_forest.fit(X_scaled)
+
+        # KMeans – adjust n_clusters if needed. Large wallet sets use mini-batches
+        # instead of 10 full Lloyd restarts over every wallet.
+        effective_k = min(N_CLUSTERS, len(X))
+        if len(X) > MINIBATCH_KMEANS_MIN_WALLETS:
+            kmeans = MiniBatchKMeans(
+                n_clusters=effective_k, random_state=42, batch_size=1024, n_init=3, max_iter=100
+            )
+        else:
+            kmeans = KMeans(n_clusters=effective_k, random_state=42, n_init=10)
+        kmeans.fit(X_scaled)
+
+        with self._model_lock:
+            self.scaler, self.isolation_forest, self.kmeans = scaler, isolation_forest, kmeans
+            self._is_trained = True
+            self._trained_on = fingerprint
+            self._warm_start = False
+        self._save_models()
+        logger.info(f"ML models trained on {len(X)} wallets")
+        return X_scaled
+
+    def _spawn_background_fit(self, X: np.ndarray, fingerprint: Tuple):
+        """Refit on X in a daemon thread unless a background fit is already running."""
+        if self._background_fit is not None and self._background_fit.is_alive():
+            return
+
+        def fit():
+            try:
+                self._fit_models(X, fingerprint)
+            except Exception as e:
+                logger.error(f"Background ML fit failed: {e}", exc_info=True)
+
+        self._background_fit = threading.Thread(target=fit, name="ml-background-fit", daemon=True)
+        self._background_fit.start()
+
+    def train_and_predict(self, db: Session) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        train() followed by predict() in one sweep: a fresh fit's scaled
+        matrix is scored directly instead of being transformed again.
+        Returns (training summary, predictions).
+
+        Right after a restart the data has usually grown since the saved models
+        were fitted (the startup ingest runs first). Instead of a cold refit,
+        those runs score with the loaded models and refit in the background;
+        the refitted models serve the following runs.
+        """
+        if not self._load_attempted:
+            self._load_models()
+
+        addresses, X, raw_profiles = self._get_features(db)
+        if self._warm_start and len(addresses) >= 5:
+            fingerprint = self._fit_fingerprint()
+            if self._trained_on != fingerprint:
+                try:
+                    predictions = self._score(addresses, X, raw_profiles)
+                except ValueError as e:  # saved models don't fit the current features
+                    logger.warning(f"Loaded ML models unusable, refitting: {e}")
+                    self._warm_start = False
+                else:
+                    self._spawn_background_fit(X, fingerprint)
+                    logger.info(f"Scored {len(addresses)} wallets with loaded ML models; refitting in background")
+                    return {
+                        "status": "loaded",
+                        "wallets": len(addresses),
+                        "clusters": self._models()[2].n_clusters,
+                    }, predictions
+
+        train_result, X_scaled = self._fit(db)
+        if train_result["status"] != "trained":
+            return train_result, []
+        return train_result, self._score(addresses, X, raw_profiles, X_scaled)
 
     def predict(self, db: Session) -> List[Dict[str, Any]]:
         """
         Run inference: anomaly detection + clustering.
         Returns list of wallet predictions with scores.
         """
-        addresses, X, raw_profiles = self.extract_features(db)
+        addresses, X, raw_profiles = self._get_features(db)
         if len(addresses) < 5:
             return []
 
+        if not self._load_attempted:
+            self._load_models()
         if not self._is_trained:
             self.train(db)
 
-        X_scaled = self.scaler.transform(X)
+        return self._score(addresses, X, raw_profiles)
 
-        # Anomaly scores: sklearn returns -1 for anomalies, 1 for normal
-        anomaly_labels = self.isolation_forest.predict(X_scaled)
-        anomaly_scores_raw = self.isolation_forest.decision_function(X_scaled)
+    def _score(
+        self,
+        addresses: List[str],
+        X: np.ndarray,
+        raw_profiles: List[Dict],
+        X_scaled: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Anomaly scores and cluster labels from the current models. Pass X_scaled
+        when it was just produced by the fit that installed those models.
+        """
+        scaler, isolation_forest, kmeans = self._models()
+        if X_scaled is None:
+            X_scaled = scaler.transform(X)
+
+        # Tree scoring only fans out under an explicit joblib backend. One
+        # decision_function pass gives both outputs: predict() is just its
+        # sign (-1 for anomalies, 1 for normal).
+        with parallel_config(backend="threading", n_jobs=-1):
+            anomaly_scores_raw = isolation_forest.decision_function(X_scaled)
+        anomaly_labels = np.where(anomaly_scores_raw < 0, -1, 1)
 
         # Normalize anomaly scores to 0-100 (higher = more anomalous)
         min_score = anomaly_scores_raw.min()
@@ -180,7 +404,7 @@ class MLEngine:
         anomaly_scores = ((max_score - anomaly_scores_raw) / score_range * 100).clip(0, 100)
 
         # Cluster labels
-        cluster_labels = self.kmeans.predict(X_scaled)
+        cluster_labels = kmeans.predict(X_scaled)
 
         results = []
         for i, addr in enumerate(addresses):
@@ -198,28 +422,30 @@ class MLEngine:
         Upsert wallet profiles into the database with ML results.
         Returns number of profiles updated.
         """
-        updated = 0
-        for pred in predictions:
-            profile = db.query(WalletProfile).filter_by(address=pred["address"]).first()
-            if not profile:
-                profile = WalletProfile(address=pred["address"])
-                db.add(profile)
-
-            profile.tx_count = pred["tx_count"]
-            profile.total_value_sent = pred["total_value_sent"]
-            profile.total_value_received = pred["total_value_received"]
-            profile.avg_value = pred["avg_value"]
-            profile.unique_counterparties = pred["unique_counterparties"]
-            profile.inflow_outflow_ratio = pred["inflow_outflow_ratio"]
-            profile.tx_frequency = pred["tx_frequency"]
-            profile.burst_score = pred["burst_score"]
-            profile.cluster_label = pred["cluster_label"]
-            profile.risk_score = pred["anomaly_score"]
-            profile.updated_at = datetime.utcnow()
-            updated += 1
-
+        if not predictions:
+            return 0
+
+        # One executemany upsert instead of a SELECT + UPDATE per wallet
+        rows = [
+            {
+                "address": pred["address"],
+                "tx_count": pred["tx_count"],
+                "total_value_sent": pred["total_value_sent"],
+                "total_value_received": pred["total_value_received"],
+                "avg_value": pred["avg_value"],
+                "unique_counterparties": pred["unique_counterparties"],
+                "inflow_outflow_ratio": pred["inflow_outflow_ratio"],
+                "tx_frequency": pred["tx_frequency"],
+                "burst_score": pred["burst_score"],
+                "cluster_label": pred["cluster_label"],
+                "risk_score": pred["anomaly_score"],
+            }
+            for pred in predictions
+        ]
+        update_columns = [column for column in rows[0] if column != "address"]
+        db.execute(upsert(WalletProfile, ["address"], update_columns), rows)
         db.commit()
-        return updated
+        return len(rows)
 
 
 # Singleton
@@ -0,0 +1,48 @@
+"""
+Detection Pipeline
+Runs ML training, wallet profiling, graph analysis and risk scoring in a
+worker process so the CPU-heavy sklearn / networkx work never competes with
+the API for the GIL. Results and the graph snapshot needed by the request
+handlers are returned to the main process.
+"""
+
+import logging
+from typing import Dict, Any
+
+from app.database import SessionLocal
+from app.services.graph_analysis import graph_analyzer
+from app.services.risk_engine import risk_engine
+
+logger = logging.getLogger("chainwatch.pipeline")
+
+
+def init_worker():
+    """Executor initializer: the worker process has no logging configured."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(name)s] %(levelname)s: %(message)s",
+    )
+
+
+def run_detection() -> Dict[str, Any]:
+    """
+    Full detection pipeline (ML → graph → flash loans → risk → alerts).
+    Returns the run summary plus a "graph_state" snapshot for GraphAnalyzer.load_state.
+    """
+    db = SessionLocal()
+    try:
+        result = risk_engine.run_full_detection(db)
+    finally:
+        db.close()
+    result["graph_state"] = graph_analyzer.export_state()
+    return result
+
+
+def build_graph_state() -> Dict[str, Any]:
+    """Build only the interaction graph and return its snapshot."""
+    db = SessionLocal()
+    try:
+        graph_analyzer.build_graph(db)
+    finally:
+        db.close()
+    return graph_analyzer.export_state()
@@ -5,9 +5,10 @@ and wash-trade score into a composite risk rating with explainability.
 """
 
 import logging
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
+import numpy as np
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
 
 from app.config import RISK_WEIGHTS
@@ -22,38 +23,116 @@ logger = logging.getLogger("chainwatch.risk")
 class RiskEngine:
     """Computes composite risk scores with explainable alerts."""
 
-    def compute_risk(self, db: Session, address: str) -> Dict[str, Any]:
+    def compute_risk(
+        self, db: Session, address: str, wash_lookup: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Any]:
         """
         Compute a composite risk score for a single wallet.
         Returns breakdown and explanation.
+        `wash_lookup` maps wallet -> best wash-trade suspicion score; pass it
+        when scoring many wallets so wash pairs are detected only once.
+        """
+        result, record = self._assess(db, address, wash_lookup)
+
+        # Upsert risk score in DB
+        risk_record = db.query(RiskScore).filter_by(wallet_address=address).first()
+        if not risk_record:
+            risk_record = RiskScore(wallet_address=address)
+            db.add(risk_record)
+        for column, value in record.items():
+            setattr(risk_record, column, value)
+        db.commit()
+
+        return result
+
+    def _assess(
+        self,
+        db: Session,
+        address: str,
+        wash_lookup: Optional[Dict[str, float]] = None,
+        profile: Optional[WalletProfile] = None,
+        graph_scores: Optional[Dict[str, float]] = None,
+        flash_lookup: Optional[Dict[str, float]] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Score one wallet without writing anything.
+        Returns (API result, RiskScore column values).
+        The optional lookups hold per-wallet component scores precomputed for
+        a whole detection run; without them each component is computed here.
         """
         # ML anomaly score
-        profile = db.query(WalletProfile).filter_by(address=address).first()
+        if profile is None:
+            profile = db.query(WalletProfile).filter_by(address=address).first()
         ml_score = profile.risk_score if profile else 0.0
 
         # Graph suspicion score
-        graph_score = graph_analyzer.get_wallet_graph_score(address)
+        if graph_scores is None:
+            graph_scores = graph_analyzer.get_all_wallet_graph_scores()
+        graph_score = graph_scores.get(address, 0.0)
 
         # Flash-loan score
-        flash_score = flash_loan_detector.get_wallet_flash_score(db, address)
+        if flash_lookup is None:
+            flash_score = flash_loan_detector.get_wallet_flash_score(db, address)
+        else:
+            flash_score = flash_lookup.get(address, 0.0)
 
         # Wash-trade score
-        wash_pairs = graph_analyzer.detect_wash_trading(db)
-        wash_score = 0.0
-        for pair in wash_pairs:
-            if pair["wallet_a"] == address or pair["wallet_b"] == address:
-                wash_score = max(wash_score, pair["suspicion_score"])
+        if wash_lookup is None:
+            wash_lookup = self._wash_lookup(graph_analyzer.detect_wash_trading(db))
+        wash_score = wash_lookup.get(address, 0.0)
 
-        # Composite weighted score
+        composite, severity = self._composite(
+            np.array([ml_score]), np.array([graph_score]),
+            np.array([flash_score]), np.array([wash_score]),
+        )
+        composite = float(composite[0])
+        severity = str(severity[0])
+        explanation = self._explain(ml_score, graph_score, flash_score, wash_score)
+
+        result = {
+            "wallet_address": address,
+            "composite_score": composite,
+            "ml_anomaly_score": round(ml_score, 2),
+            "graph_score": round(graph_score, 2),
+            "flash_loan_score": round(flash_score, 2),
+            "wash_trade_score": round(wash_score, 2),
+            "severity": severity,
+            "explanation": explanation,
+        }
+
+        record = {
+            "composite_score": composite,
+            "ml_anomaly_score": ml_score,
+            "graph_score": graph_score,
+            "flash_loan_score": flash_score,
+            "wash_trade_score": wash_score,
+            "explanation": explanation,
+        }
+        return result, record
+
+    @staticmethod
+    def _composite(
+        ml: np.ndarray, graph: np.ndarray, flash: np.ndarray, wash: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Composite score and severity label for arrays of component scores."""
         composite = (
-            RISK_WEIGHTS["ml_anomaly"] * ml_score +
-            RISK_WEIGHTS["graph_suspicion"] * graph_score +
-            RISK_WEIGHTS["flash_loan"] * flash_score +
-            RISK_WEIGHTS["wash_trade"] * wash_score
+            RISK_WEIGHTS["ml_anomaly"] * ml +
+            RISK_WEIGHTS["graph_suspicion"] * graph +
+            RISK_WEIGHTS["flash_loan"] * flash +
+            RISK_WEIGHTS["wash_trade"] * wash
+        )
+        # Python's round() rather than np.round, which can land half-way cases
+        # on the other side and shift stored scores by 0.01
+        composite = np.minimum([round(c, 2) for c in composite.tolist()], 100.0)
+        severity = np.select(
+            [composite >= 75, composite >= 50, composite >= 25],
+            ["critical", "high", "medium"],
+            "low",
         )
-        composite = min(round(composite, 2), 100.0)
+        return composite, severity
 
-        # Build explanation
+    @staticmethod
+    def _explain(ml_score: float, graph_score: float, flash_score: float, wash_score: float) -> str:
         explanations = []
         if ml_score > 50:
             explanations.append(f"ML anomaly score is high ({ml_score:.0f}/100)")
@@ -64,44 +143,41 @@ class RiskEngine:
         if wash_score > 40:
             explanations.append(f"Possible wash-trading behaviour ({wash_score:.0f}/100)")
 
-        explanation = "; ".join(explanations) if explanations else "No significant risk factors detected."
+        return "; ".join(explanations) if explanations else "No significant risk factors detected."
 
-        # Severity
-        if composite >= 75:
-            severity = "critical"
-        elif composite >= 50:
-            severity = "high"
-        elif composite >= 25:
-            severity = "medium"
-        else:
-            severity = "low"
-
-        result = {
-            "wallet_address": address,
-            "composite_score": composite,
-            "ml_anomaly_score": round(ml_score, 2),
-            "graph_score": round(graph_score, 2),
-            "flash_loan_score": round(flash_score, 2),
-            "wash_trade_score": round(wash_score, 2),
-            "severity": severity,
-            "explanation": explanation,
-        }
+    @staticmethod
+    def _save_risk_scores(db: Session, records: Dict[str, Dict[str, Any]]):
+        """Bulk-write RiskScore rows: UPDATE by primary key where present, INSERT the rest."""
+        existing = dict(db.execute(select(RiskScore.wallet_address, RiskScore.id)).all())
+        updates = []
+        inserts = []
+        for address, record in records.items():
+            if address in existing:
+                updates.append({"id": existing[address], **record})
+            else:
+                inserts.append({"wallet_address": address, **record})
+        if updates:
+            db.execute(update(RiskScore), updates)
+        if inserts:
+            db.execute(insert(RiskScore), inserts)
 
-        # Upsert risk score in DB
-        risk_record = db.query(RiskScore).filter_by(wallet_address=address).first()
-        if not risk_record:
-            risk_record = RiskScore(wallet_address=address)
-            db.add(risk_record)
-        risk_record.composite_score = composite
-        risk_record.ml_anomaly_score = ml_score
-        risk_record.graph_score = graph_score
-        risk_record.flash_loan_score = flash_score
-        risk_record.wash_trade_score = wash_score
-        risk_record.explanation = explanation
-        risk_record.updated_at = datetime.utcnow()
-        db.commit()
+    @staticmethod
+    def _wash_lookup(wash_pairs: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Highest wash-trade suspicion score per wallet across all pairs."""
+        lookup: Dict[str, float] = {}
+        for pair in wash_pairs:
+            for wallet in (pair["wallet_a"], pair["wallet_b"]):
+                lookup[wallet] = max(lookup.get(wallet, 0.0), pair["suspicion_score"])
+        return lookup
 
-        return result
+    @staticmethod
+    def _flash_lookup(flash_events: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Highest flash-loan score per wallet across all detected events."""
+        lookup: Dict[str, float] = {}
+        for event in flash_events:
+            wallet = event["wallet"]
+            lookup[wallet] = max(lookup.get(wallet, 0.0), event["flash_loan_score"])
+        return lookup
 
     def run_full_detection(self, db: Session) -> Dict[str, Any]:
         """
@@ -116,8 +192,7 @@ class RiskEngine:
         Returns summary.
         """
         # Step 1: ML
-        train_result = ml_engine.train(db)
-        predictions = ml_engine.predict(db)
+        train_result, predictions = ml_engine.train_and_predict(db)
         ml_engine.update_wallet_profiles(db, predictions)
 
         # Step 2: Graph
@@ -131,32 +206,59 @@ class RiskEngine:
 
         # Step 4: Compute composite risk for all profiled wallets
         profiles = db.query(WalletProfile).all()
-        alerts_generated = 0
-
-        for profile in profiles:
-            risk = self.compute_risk(db, profile.address)
-
-            # Generate alert if risk is significant
-            if risk["composite_score"] >= 40:
-                alert_type = "anomaly"
-                if risk["flash_loan_score"] > 50:
-                    alert_type = "flash_loan"
-                elif risk["wash_trade_score"] > 40:
-                    alert_type = "wash_trade"
-                elif risk["graph_score"] > 30:
-                    alert_type = "high_centrality"
-
-                alert = Alert(
-                    wallet_address=profile.address,
-                    alert_type=alert_type,
-                    severity=risk["severity"],
-                    risk_score=risk["composite_score"],
-                    explanation=risk["explanation"],
-                )
-                db.add(alert)
-                alerts_generated += 1
+        # Per-wallet component scores, each computed once for the whole run
+        wash_lookup = self._wash_lookup(wash_pairs)
+        flash_lookup = self._flash_lookup(flash_events)
+        graph_scores = graph_analyzer.get_all_wallet_graph_scores()
+        addresses = [profile.address for profile in profiles]
+        ml = np.array([profile.risk_score for profile in profiles], dtype=np.float64)
+        graph = np.array([graph_scores.get(a, 0.0) for a in addresses], dtype=np.float64)
+        flash = np.array([flash_lookup.get(a, 0.0) for a in addresses], dtype=np.float64)
+        wash = np.array([wash_lookup.get(a, 0.0) for a in addresses], dtype=np.float64)
+
+        # Composite + severity for every wallet at once
+        composite, severity = self._composite(ml, graph, flash, wash)
+
+        risk_records: Dict[str, Dict[str, Any]] = {}
+        for address, c, m, g, f, w in zip(
+            addresses, composite.tolist(), ml.tolist(), graph.tolist(), flash.tolist(), wash.tolist()
+        ):
+            risk_records[address] = {
+                "composite_score": c,
+                "ml_anomaly_score": m,
+                "graph_score": g,
+                "flash_loan_score": f,
+                "wash_trade_score": w,
+                "explanation": self._explain(m, g, f, w),
+            }
+
+        # Generate alerts only where risk is significant
+        alert_rows: List[Dict[str, Any]] = []
+        for i in np.flatnonzero(composite >= 40).tolist():
+            address = addresses[i]
+            record = risk_records[address]
+            alert_type = "anomaly"
+            if round(record["flash_loan_score"], 2) > 50:
+                alert_type = "flash_loan"
+            elif round(record["wash_trade_score"], 2) > 40:
+                alert_type = "wash_trade"
+            elif round(record["graph_score"], 2) > 30:
+                alert_type = "high_centrality"
+
+            alert_rows.append({
+                "wallet_address": address,
+                "alert_type": alert_type,
+                "severity": str(severity[i]),
+                "risk_score": record["composite_score"],
+                "explanation": record["explanation"],
+            })
 
+        # Risk scores and alerts land in one transaction, a few statements total
+        self._save_risk_scores(db, risk_records)
+        if alert_rows:
+            db.execute(insert(Alert), alert_rows)
         db.commit()
+        alerts_generated = len(alert_rows)
 
         return {
             "ml_training": train_result,
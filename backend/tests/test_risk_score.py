@@ -0,0 +1,50 @@
+"""GET /api/risk-score before any block has been ingested in this process."""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp.name}/test.db"
+os.environ["ML_MODEL_PATH"] = ""
+os.environ["ETH_RPC_URL"] = "http://127.0.0.1:1"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.database import SessionLocal, Transaction, init_db  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.blockchain import blockchain_service  # noqa: E402
+
+WALLET = "0x" + "11" * 20
+
+
+class RiskScoreBeforeIngestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Rows from a previous run, but the startup ingest never succeeded
+        init_db()
+        db = SessionLocal()
+        db.add(Transaction(
+            tx_hash="0x" + "ab" * 32, block_number=100, from_address=WALLET,
+            to_address="0x" + "22" * 20, value_eth=1.0, timestamp=datetime.utcnow(),
+        ))
+        db.commit()
+        db.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        _tmp.cleanup()
+
+    def test_scores_wallet_when_no_block_processed(self):
+        self.assertIsNone(blockchain_service.last_processed_block)
+        response = TestClient(app).get(f"/api/risk-score/{WALLET}")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["wallet_address"], WALLET)
+        self.assertEqual(body["tx_count"], 1)
+        self.assertIn("composite_score", body)
+
+
+if __name__ == "__main__":
+    unittest.main()